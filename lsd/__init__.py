@@ -1,6 +1,10 @@
 from __future__ import absolute_import
 from .agglomerate import LsdAgglomeration
+from .columnar_rag import ColumnarRag
+from .extract_segmentation import extract_segmentation
+from .find_segments import find_segments
 from .local_shape_descriptor import LsdExtractor
+from .merge_hierarchy import MergeHierarchy
 from .merge_tree import MergeTree
 from .parallel_aff_agglomerate import parallel_aff_agglomerate, agglomerate_in_block
 from .parallel_fragments import parallel_watershed, watershed_in_block
@@ -8,5 +12,6 @@ from .parallel_lsd_agglomerate import parallel_lsd_agglomerate
 from .rag import Rag
 from .shared_rag_provider import SharedRagProvider, SubRag
 from . import fragments
+from . import rag_transport
 from . import gp
 from . import persistence
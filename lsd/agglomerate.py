@@ -6,8 +6,8 @@ import matplotlib
 matplotlib.use('Agg')
 
 from scipy.ndimage.measurements import find_objects
-from skimage.future.graph import RAG
 from .graph_merge import merge_hierarchical
+from .rag import Rag
 import gunpowder as gp
 import numpy as np
 import logging
@@ -110,7 +110,7 @@ class LsdAgglomeration(object):
         if self.rag is None:
 
             self.__log_info("Extracting RAG from fragments...")
-            self.rag = RAG(self.fragments, connectivity=2)
+            self.rag = Rag(self.fragments, connectivity=2)
 
         self.__log_info(
             "RAG contains %d nodes and %d edges",
@@ -126,6 +126,11 @@ class LsdAgglomeration(object):
             self.__log_debug("Initializing node %d", u)
             data = self.rag.node[u]
 
+            if 'roi' not in data and 'bbox' in data:
+
+                # reuse the bounding box found during RAG extraction
+                data['roi'] = self.__slice_to_roi(data['bbox'])
+
             if 'roi' not in data:
 
                 bbs = find_objects(self.fragments==u)
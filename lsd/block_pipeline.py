@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import daisy
+import logging
+
+logger = logging.getLogger(__name__)
+
+def run_pipelined_worker(read, process, write, pipeline_depth, flush=None):
+    '''Process blocks handed out by daisy, overlapping I/O and computation.
+
+    This function is meant to be called as a daisy worker (i.e., by a process
+    function without arguments passed to ``daisy.run_blockwise``). It
+    acquires blocks until there are none left. Each block is processed in
+    three steps::
+
+        data = read(block)
+        result = process(block, data)
+        write(block, result)
+
+    Reads of the next ``pipeline_depth`` blocks are prefetched in a background
+    thread while the current block is processed. Writes happen in another
+    background thread, with at most ``pipeline_depth`` writes pending. A
+    block is released only after it has been written. If ``pipeline_depth``
+    is 0, blocks are read, processed, and written one after the other in the
+    calling thread.
+
+    ``read`` and ``write`` are called from different threads at the same
+    time. RAG providers can be shared between them.
+
+    If given, ``flush`` is called after the last block was written, e.g., to
+    write the buffer of a `class:BufferedRagProvider`. Workers exit without
+    running ``atexit`` handlers, this is the last chance to write anything.
+
+    Args:
+
+        read, process, write (``callable``):
+
+            The three steps of processing a block, see above.
+
+        pipeline_depth (``int``):
+
+            How many blocks to read ahead and to write behind, or 0 to not
+            use background threads.
+
+        flush (``callable``, optional):
+
+            Called without arguments after all blocks were written.
+    '''
+
+    assert pipeline_depth >= 0, "pipeline_depth can not be negative"
+
+    client = daisy.Client()
+
+    if pipeline_depth == 0:
+        _run_sequential(client, read, process, write)
+        if flush is not None:
+            flush()
+        return
+
+    reader = ThreadPoolExecutor(max_workers=1)
+    writer = ThreadPoolExecutor(max_workers=1)
+
+    reads = deque()
+    writes = deque()
+
+    def acquire():
+
+        block = client.acquire_block()
+        if block is None:
+            return False
+
+        logger.debug("prefetching block %d", block.block_id)
+        reads.append((block, reader.submit(read, block)))
+
+        return True
+
+    def release(block, future):
+
+        try:
+            future.result()
+            ret = 0
+        except Exception:
+            logger.exception("block %d failed", block.block_id)
+            ret = 1
+
+        client.release_block(block, ret)
+
+    try:
+
+        more_blocks = True
+        while more_blocks and len(reads) < pipeline_depth:
+            more_blocks = acquire()
+
+        while len(reads) > 0:
+
+            block, data = reads.popleft()
+
+            # keep the read queue full
+            if more_blocks:
+                more_blocks = acquire()
+
+            try:
+                result = process(block, data.result())
+            except Exception:
+                logger.exception("block %d failed", block.block_id)
+                client.release_block(block, 1)
+                continue
+
+            writes.append((block, writer.submit(write, block, result)))
+
+            # release written blocks, wait if too many writes are pending
+            while (
+                    len(writes) > pipeline_depth or
+                    (len(writes) > 0 and writes[0][1].done())):
+                release(*writes.popleft())
+
+        while len(writes) > 0:
+            release(*writes.popleft())
+
+        if flush is not None:
+            flush()
+
+    finally:
+
+        reader.shutdown()
+        writer.shutdown()
+
+def _run_sequential(client, read, process, write):
+
+    while True:
+
+        block = client.acquire_block()
+        if block is None:
+            return
+
+        try:
+            write(block, process(block, read(block)))
+            ret = 0
+        except Exception:
+            logger.exception("block %d failed", block.block_id)
+            ret = 1
+
+        client.release_block(block, ret)
@@ -0,0 +1,300 @@
+from __future__ import absolute_import
+from .rag import Rag
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ColumnarRag(object):
+    '''A region adjacency graph (RAG) stored as contiguous numpy arrays, for
+    graphs too large to be held as a `class:Rag`.
+
+    Node columns (sorted by ``node_ids``):
+
+        node_ids (``uint64``):
+
+            The ID of each node.
+
+        node_centers (``float32``, shape ``(n, 3)``):
+
+            The ``z``, ``y``, and ``x`` center of each node, ``NaN`` if not
+            known.
+
+        node_sizes (``uint64``):
+
+            The size of each node, 0 if not known.
+
+    Edge columns:
+
+        edges_u, edges_v (``uint64``):
+
+            The IDs of the nodes incident to each edge.
+
+        merge_score (``float32``):
+
+            The score at which an edge was merged, ``NaN`` for ``None``.
+
+        agglomerated (``uint8``):
+
+            Whether an edge was processed by an agglomeration algorithm.
+
+    Adjacency (in CSR format, indexed by node index):
+
+        indptr (``int64``):
+
+            The neighbors of node ``i`` are stored at
+            ``indptr[i]:indptr[i + 1]`` in ``neighbor_indices`` and
+            ``incident_edge_indices``.
+
+        neighbor_indices (``int64``):
+
+            The indices of the neighboring nodes.
+
+        incident_edge_indices (``int64``):
+
+            The indices of the edges connecting to the neighboring nodes.
+
+    Nodes that are only referenced by edges are added without center and
+    size, like nodes pulled into a `class:SubRag` by edges leaving its ROI.
+
+    Args:
+
+        node_ids, node_centers, node_sizes, edges_u, edges_v, merge_score,
+        agglomerated (``ndarray``, optional):
+
+            Initial columns, see above. Nodes do not have to be sorted.
+    '''
+
+    def __init__(
+            self,
+            node_ids=None,
+            node_centers=None,
+            node_sizes=None,
+            edges_u=None,
+            edges_v=None,
+            merge_score=None,
+            agglomerated=None):
+
+        if node_ids is None:
+            node_ids = np.zeros((0,), dtype=np.uint64)
+        node_ids = np.asarray(node_ids, dtype=np.uint64)
+        num_nodes = len(node_ids)
+
+        if node_centers is None:
+            node_centers = np.full((num_nodes, 3), np.nan, dtype=np.float32)
+        if node_sizes is None:
+            node_sizes = np.zeros((num_nodes,), dtype=np.uint64)
+
+        if edges_u is None:
+            edges_u = np.zeros((0,), dtype=np.uint64)
+            edges_v = np.zeros((0,), dtype=np.uint64)
+        edges_u = np.asarray(edges_u, dtype=np.uint64)
+        edges_v = np.asarray(edges_v, dtype=np.uint64)
+        num_edges = len(edges_u)
+
+        if merge_score is None:
+            merge_score = np.full((num_edges,), np.nan, dtype=np.float32)
+        if agglomerated is None:
+            agglomerated = np.zeros((num_edges,), dtype=np.uint8)
+
+        # add nodes that are only referenced by edges
+        missing = np.setdiff1d(
+            np.concatenate([edges_u, edges_v]),
+            node_ids)
+        if len(missing) > 0:
+            node_ids = np.concatenate([node_ids, missing])
+            node_centers = np.concatenate([
+                node_centers,
+                np.full((len(missing), 3), np.nan, dtype=np.float32)])
+            node_sizes = np.concatenate([
+                node_sizes,
+                np.zeros((len(missing),), dtype=np.uint64)])
+
+        order = np.argsort(node_ids)
+        self.node_ids = np.ascontiguousarray(node_ids[order])
+        self.node_centers = np.ascontiguousarray(
+            node_centers[order],
+            dtype=np.float32)
+        self.node_sizes = np.ascontiguousarray(
+            node_sizes[order],
+            dtype=np.uint64)
+
+        self.edges_u = np.ascontiguousarray(edges_u)
+        self.edges_v = np.ascontiguousarray(edges_v)
+        self.merge_score = np.ascontiguousarray(merge_score, dtype=np.float32)
+        self.agglomerated = np.ascontiguousarray(agglomerated, dtype=np.uint8)
+
+        self.__create_adjacency()
+
+    @staticmethod
+    def from_rag(rag):
+        '''Create a `class:ColumnarRag` from a `class:Rag`.'''
+
+        num_nodes = rag.number_of_nodes()
+        num_edges = rag.number_of_edges()
+
+        node_ids = np.zeros((num_nodes,), dtype=np.uint64)
+        node_centers = np.full((num_nodes, 3), np.nan, dtype=np.float32)
+        node_sizes = np.zeros((num_nodes,), dtype=np.uint64)
+
+        for i, (node, data) in enumerate(rag.nodes(data=True)):
+            node_ids[i] = node
+            node_centers[i] = [
+                data.get('center_%s'%dim, np.nan)
+                for dim in ['z', 'y', 'x']
+            ]
+            node_sizes[i] = data.get('size', 0)
+
+        edges_u = np.zeros((num_edges,), dtype=np.uint64)
+        edges_v = np.zeros((num_edges,), dtype=np.uint64)
+        merge_score = np.full((num_edges,), np.nan, dtype=np.float32)
+        agglomerated = np.zeros((num_edges,), dtype=np.uint8)
+
+        for i, (u, v, data) in enumerate(rag.edges(data=True)):
+            edges_u[i], edges_v[i] = min(u, v), max(u, v)
+            if data.get('merge_score') is not None:
+                merge_score[i] = data['merge_score']
+            agglomerated[i] = data.get('agglomerated') or 0
+
+        return ColumnarRag(
+            node_ids,
+            node_centers,
+            node_sizes,
+            edges_u,
+            edges_v,
+            merge_score,
+            agglomerated)
+
+    def to_rag(self, rag=None):
+        '''Convert this RAG into a `class:Rag`.
+
+        Args:
+
+            rag (`class:Rag`, optional):
+
+                If given, nodes and edges are added to this RAG instead of a
+                new one.
+        '''
+
+        if rag is None:
+            rag = Rag()
+
+        for node, center, size in zip(
+                self.node_ids.tolist(),
+                self.node_centers.tolist(),
+                self.node_sizes.tolist()):
+
+            data = {}
+            if not np.isnan(center[0]):
+                data.update({
+                    'center_z': center[0],
+                    'center_y': center[1],
+                    'center_x': center[2]
+                })
+            if size > 0:
+                data['size'] = size
+
+            rag.add_node(node, **data)
+
+        rag.add_edges_from(
+            (
+                u, v,
+                {
+                    'merge_score': score if not np.isnan(score) else None,
+                    'agglomerated': agglomerated
+                }
+            )
+            for u, v, score, agglomerated in zip(
+                self.edges_u.tolist(),
+                self.edges_v.tolist(),
+                self.merge_score.tolist(),
+                self.agglomerated.tolist())
+        )
+
+        return rag
+
+    def number_of_nodes(self):
+
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+
+        return len(self.edges_u)
+
+    def node_index(self, nodes):
+        '''Get the index of the given node (or array of nodes) into the node
+        columns.'''
+
+        indices = np.searchsorted(self.node_ids, nodes)
+        assert np.all(indices < len(self.node_ids)), (
+            "Not all nodes are part of this RAG")
+        assert np.all(self.node_ids[indices] == nodes), (
+            "Not all nodes are part of this RAG")
+
+        return indices
+
+    def neighbors(self, node):
+        '''Get the IDs of all neighbors of a node.'''
+
+        i = self.node_index(node)
+
+        return self.node_ids[
+            self.neighbor_indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def incident_edges(self, node):
+        '''Get the indices into the edge columns of all edges incident to a
+        node.'''
+
+        i = self.node_index(node)
+
+        return self.incident_edge_indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def get_component_labels(self, threshold):
+        '''Get the connected component of each node, as indicated by the
+        ``merge_score`` of edges. Returns an array of component labels in
+        ``[0, num_components)``, aligned with ``node_ids``.'''
+
+        # NaN scores compare as False
+        merged = self.merge_score <= threshold
+
+        num_nodes = self.number_of_nodes()
+        merge_graph = coo_matrix(
+            (
+                np.ones((np.count_nonzero(merged),), dtype=np.uint8),
+                (
+                    self.node_index(self.edges_u[merged]),
+                    self.node_index(self.edges_v[merged])
+                )
+            ),
+            shape=(num_nodes, num_nodes))
+
+        _, labels = connected_components(merge_graph, directed=False)
+
+        return labels
+
+    def __create_adjacency(self):
+
+        num_nodes = self.number_of_nodes()
+        num_edges = self.number_of_edges()
+
+        u = np.searchsorted(self.node_ids, self.edges_u)
+        v = np.searchsorted(self.node_ids, self.edges_v)
+
+        # every edge is listed once for each of its nodes
+        endpoints = np.concatenate([u, v])
+        order = np.argsort(endpoints, kind='stable')
+
+        self.neighbor_indices = np.concatenate([v, u])[order]
+        self.incident_edge_indices = np.concatenate([
+            np.arange(num_edges),
+            np.arange(num_edges)])[order]
+        self.indptr = np.zeros((num_nodes + 1,), dtype=np.int64)
+        np.cumsum(
+            np.bincount(endpoints, minlength=num_nodes),
+            out=self.indptr[1:])
+
+        logger.debug(
+            "created adjacency for %d nodes and %d edges",
+            num_nodes, num_edges)
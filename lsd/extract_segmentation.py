@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+from .find_segments import load_lut
+import daisy
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# LUTs memory-mapped by this process (each daisy worker loads a LUT once)
+_luts = {}
+
+def extract_segmentation(
+        fragments,
+        lut,
+        segmentation_out,
+        block_size,
+        num_workers,
+        roi=None):
+    '''Relabel fragments into a segmentation in parallel, using a LUT found
+    by :func:`find_segments`.
+
+    Args:
+
+        fragments (`class:daisy.Array`):
+
+            An array containing fragments.
+
+        lut (``string``):
+
+            The file storing the fragment to segment LUT, see
+            :func:`lut_filename`. The LUT is memory-mapped once in each
+            worker. Fragments not in the LUT are set to 0.
+
+        segmentation_out (`class:daisy.Array`):
+
+            An array to store the segmentation in.
+
+        block_size (``tuple`` of ``int``):
+
+            The size of the blocks to process in parallel, in world units.
+            Has to be a multiple of the chunk size of ``segmentation_out``,
+            such that no two blocks write to the same chunk.
+
+        num_workers (``int``):
+
+            The number of parallel workers.
+
+        roi (`class:daisy.Roi`, optional):
+
+            The ROI to relabel. Defaults to the ROI of ``fragments``.
+
+    Returns:
+
+        True, if all tasks succeeded.
+    '''
+
+    assert segmentation_out.data.dtype == np.uint64
+
+    if roi is None:
+        roi = fragments.roi
+
+    block_roi = daisy.Roi((0,)*roi.dims(), block_size)
+
+    _check_chunk_alignment(segmentation_out, roi, block_roi)
+
+    return daisy.run_blockwise(
+        roi,
+        block_roi,
+        block_roi,
+        lambda b: extract_segmentation_in_block(
+            fragments,
+            lut,
+            segmentation_out,
+            b),
+        num_workers=num_workers,
+        read_write_conflict=False,
+        fit='shrink')
+
+def extract_segmentation_in_block(fragments, lut, segmentation_out, block):
+
+    logger.debug("relabelling fragments in %s", block.write_roi)
+
+    fragments = fragments.to_ndarray(block.write_roi)
+    segmentation = relabel_fragments(fragments, *_get_lut(lut))
+
+    segmentation_out[block.write_roi] = segmentation
+
+def relabel_fragments(fragments, lut_fragments, lut_segments):
+    '''Replace each fragment in the array ``fragments`` with its segment,
+    given by the sorted ``lut_fragments`` and their ``lut_segments``.
+    Fragments not in the LUT are set to 0.'''
+
+    # look up each fragment only once, with sorted queries into the LUT
+    values, inverse = np.unique(fragments, return_inverse=True)
+
+    if len(lut_fragments) == 0:
+        return np.zeros(fragments.shape, dtype=np.uint64)
+
+    indices = np.searchsorted(lut_fragments, values)
+    indices[indices == len(lut_fragments)] = 0
+    found = lut_fragments[indices] == values
+
+    segments = np.where(found, lut_segments[indices], 0).astype(np.uint64)
+
+    return segments[inverse].reshape(fragments.shape)
+
+def _get_lut(filename):
+
+    if filename not in _luts:
+        logger.info("loading LUT %s", filename)
+        _luts[filename] = load_lut(filename)
+
+    return _luts[filename]
+
+def _check_chunk_alignment(array, roi, block_roi):
+
+    chunks = getattr(array.data, 'chunks', None)
+    if chunks is None:
+        return
+
+    chunk_size = daisy.Coordinate(chunks[-roi.dims():])*array.voxel_size
+    offset = roi.get_begin() - array.roi.get_begin()
+
+    assert all(
+        b%c == 0 and o%c == 0
+        for b, o, c in zip(block_roi.get_shape(), offset, chunk_size)), (
+            "blocks of size %s starting at %s are not aligned with the "
+            "chunks of size %s of the output array"%(
+                block_roi.get_shape(), roi.get_begin(), chunk_size))
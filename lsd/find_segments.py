@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+import logging
+import numpy as np
+import os
+import struct
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+def lut_filename(out_dir, threshold):
+    '''Get the name of the file storing the fragment to segment LUT for
+    ``threshold``, as written by :func:`find_segments`.'''
+
+    return os.path.join(out_dir, 'lut_%g.npz'%threshold)
+
+def load_lut(filename):
+    '''Memory-map the LUT stored by :func:`find_segments` in ``filename``.
+    Returns the sorted fragment IDs and their segment IDs as two arrays.'''
+
+    with zipfile.ZipFile(filename) as f:
+        info = f.getinfo('fragment_segment_lut.npy')
+
+    assert info.compress_type == zipfile.ZIP_STORED, (
+        "compressed LUTs can not be memory-mapped")
+
+    with open(filename, 'rb') as f:
+
+        # the member's data follows its local file header (30 bytes) and
+        # the header's variable-length file name and extra field
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        if np.lib.format.read_magic(f) == (1, 0):
+            read_header = np.lib.format.read_array_header_1_0
+        else:
+            read_header = np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+
+    lut = np.memmap(
+        filename,
+        dtype=dtype,
+        mode='r',
+        offset=offset,
+        shape=shape,
+        order='F' if fortran_order else 'C')
+
+    return lut[0], lut[1]
+
+def read_sorted_edges(rag_provider, roi=None):
+    '''Read the edges of a RAG, sorted by their ``merge_score``.
+
+    Returns the sorted IDs of all fragments (nodes, including those only
+    referenced by edges), the indices of ``u`` and ``v`` of each edge into
+    the fragment IDs, and the scores of the edges (``float64``). Edges without
+    score come last, with a score of ``NaN``.
+    '''
+
+    start = time.time()
+
+    nodes = rag_provider.read_nodes_array(roi)['id']
+    edges = rag_provider.read_edges_array(roi, attrs=['merge_score'])
+
+    logger.info(
+        "read %d nodes and %d edges in %.3fs",
+        len(nodes), len(edges['u']), time.time() - start)
+
+    # edges can reference nodes outside of roi or without center, get the
+    # fragment index of each edge's nodes in the same pass
+    num_nodes = len(nodes)
+    num_edges = len(edges['u'])
+    fragments, indices = np.unique(
+        np.concatenate([nodes, edges['u'], edges['v']]),
+        return_inverse=True)
+
+    # sort edges by score, unscored edges (NaN) go last
+    order = np.argsort(edges['merge_score'], kind='stable')
+    scores = edges['merge_score'][order]
+    u = indices[num_nodes:num_nodes + num_edges][order]
+    v = indices[num_nodes + num_edges:][order]
+
+    return fragments, u, v, scores
+
+def find_segments(rag_provider, thresholds, out_dir, roi=None):
+    '''Find the segments of a RAG for several thresholds and store them as
+    lookup tables (LUTs) from fragment IDs to segment IDs.
+
+    Fragments are merged into a segment if they are connected by edges with
+    a ``merge_score`` of at most the threshold (edges without score are never
+    merged). The RAG is read once as arrays, and edges are sorted by their
+    score. Thresholds are then processed in increasing order: Each threshold
+    only adds the edges scored since the previous threshold to the segments
+    found so far, such that all thresholds take about as long as one.
+
+    For each threshold, the LUT is stored in :func:`lut_filename` as array
+    ``fragment_segment_lut`` of shape ``(2, n)``, with fragment IDs (sorted)
+    in the first and segment IDs (starting at 1) in the second row. The files
+    are not compressed, such that the LUTs can be memory-mapped.
+
+    Args:
+
+        rag_provider (`class:SharedRagProvider`):
+
+            The RAG to segment.
+
+        thresholds (``list`` of ``float``):
+
+            The merge score thresholds to find segments for.
+
+        out_dir (``string``):
+
+            The directory to store the LUTs in.
+
+        roi (``daisy.Roi``, optional):
+
+            If given, segment only the fragments in ``roi`` (and their
+            neighbors). Defaults to the whole RAG.
+    '''
+
+    fragments, u, v, scores = read_sorted_edges(rag_provider, roi)
+    num_fragments = len(fragments)
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    # the component of each fragment, for the thresholds processed so far
+    components = np.arange(num_fragments, dtype=np.int64)
+    num_components = num_fragments
+    num_merged = 0
+
+    for threshold in sorted(thresholds):
+
+        start = time.time()
+
+        # contract the new edges into the components found so far
+        end = np.searchsorted(scores, threshold, side='right')
+        cu = components[u[num_merged:end]]
+        cv = components[v[num_merged:end]]
+        num_merged = end
+
+        merge_graph = coo_matrix(
+            (np.ones((len(cu),), dtype=np.uint8), (cu, cv)),
+            shape=(num_components, num_components))
+        num_components, labels = connected_components(
+            merge_graph,
+            directed=False)
+        components = labels[components]
+
+        lut = np.array([
+            fragments,
+            components.astype(np.uint64) + 1
+        ])
+        np.savez(
+            lut_filename(out_dir, threshold),
+            fragment_segment_lut=lut)
+
+        logger.info(
+            "found %d segments for threshold %g in %.3fs",
+            num_components, threshold, time.time() - start)
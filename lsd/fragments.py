@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import mahotas
 import numpy as np
 import logging
@@ -28,10 +29,14 @@ def watershed_from_affinities(
         max_affinity_value,
         fragments_in_xy=False,
         return_seeds=False,
-        min_seed_distance=10):
+        min_seed_distance=10,
+        num_threads=1):
     '''Extract initial fragments from affinities using a watershed
     transform. Returns the fragments and the maximal ID in it.
 
+    If ``fragments_in_xy`` is set, the xy-sections are processed in parallel
+    by ``num_threads`` threads.
+
     Returns:
 
         (fragments, max_id)
@@ -43,29 +48,43 @@ def watershed_from_affinities(
         mean_affs = 0.5*(affs[1] + affs[2])
         depth = mean_affs.shape[0]
 
-        fragments = np.zeros(mean_affs.shape, dtype=np.uint64)
-        if return_seeds:
-            seeds = np.zeros(mean_affs.shape, dtype=np.uint64)
-
-        id_offset = 0
-        for z in range(depth):
+        def watershed_in_section(z):
 
             boundary_mask = mean_affs[z]>0.5*max_affinity_value
             boundary_distances = distance_transform_edt(boundary_mask)
 
-            ret = watershed_from_boundary_distance(
+            return watershed_from_boundary_distance(
                 boundary_distances,
                 return_seeds=return_seeds,
-                id_offset=id_offset,
                 min_seed_distance=min_seed_distance)
 
+        if num_threads > 1:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                sections = list(executor.map(
+                    watershed_in_section,
+                    range(depth)))
+        else:
+            sections = [watershed_in_section(z) for z in range(depth)]
+
+        fragments = np.zeros(mean_affs.shape, dtype=np.uint64)
+        if return_seeds:
+            seeds = np.zeros(mean_affs.shape, dtype=np.uint64)
+
+        # make IDs unique by offsetting each section by the number of
+        # fragments in all previous sections
+        num_fragments = np.array([ret[1] for ret in sections], dtype=np.uint64)
+        id_offsets = np.cumsum(num_fragments) - num_fragments
+
+        for z, (ret, id_offset) in enumerate(zip(sections, id_offsets)):
+
             fragments[z] = ret[0]
-            if return_seeds:
-                seeds[z] = ret[2]
+            fragments[z][fragments[z]>0] += id_offset
 
-            id_offset = ret[1]
+            if return_seeds and len(ret) > 2:
+                seeds[z] = ret[2]
+                seeds[z][seeds[z]>0] += id_offset
 
-        ret = (fragments, id_offset)
+        ret = (fragments, int(num_fragments.sum()))
         if return_seeds:
             ret += (seeds,)
 
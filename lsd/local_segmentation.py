@@ -1,12 +1,58 @@
 import daisy
-from funlib.segment.arrays import replace_values
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
+from .columnar_rag import ColumnarRag
+from .extract_segmentation import relabel_fragments
+from .merge_hierarchy import MergeHierarchy
 from .persistence import MongoDbRagProvider
 
+logger = logging.getLogger(__name__)
+
 
 class LocalSegmentationExtractor:
+    '''Extract segmentations of small ROIs from fragments and a RAG stored in
+    MongoDB, for any threshold.
+
+    The fragments dataset and the RAG provider are opened once and kept open,
+    such that the extractor can be used to serve many requests. Requests can
+    be answered concurrently with :func:`submit`, or by calling
+    :func:`get_local_segmentation` from several threads.
+
+    Args:
+
+        fragments_host, fragments_db, edges_collection (``string``):
+
+            The MongoDB host, database, and edges collection of the RAG.
+
+        fragments_file, fragments_dataset (``string``):
+
+            The container and dataset of the fragments.
+
+        num_threads (``int``, optional):
+
+            The number of threads answering requests passed to
+            :func:`submit`.
+
+        max_cached_rois (``int``, optional):
+
+            The number of ROIs to keep the fragments and sub-RAGs of. If a
+            request is for a cached ROI, neither fragments nor RAG are read
+            again (e.g., when changing the threshold). The least recently used
+            ROIs are dropped first.
+
+        merge_hierarchy (``string``, optional):
+
+            The directory of a `class:MergeHierarchy` of the RAG. If given,
+            segments are looked up in the hierarchy instead of being found in
+            the sub-RAG of the ROI, and the RAG is not read at all. Segment
+            IDs are then consistent between ROIs.
+    '''
+
     def __init__(
         self,
         fragments_host: str,
@@ -14,48 +60,246 @@ class LocalSegmentationExtractor:
         edges_collection: str,
         fragments_file: str,
         fragments_dataset: str,
+        num_threads: int = 1,
+        max_cached_rois: int = 0,
+        merge_hierarchy: str = None,
     ):
         self.fragments_host = fragments_host
         self.fragments_db = fragments_db
         self.edges_collection = edges_collection
         self.fragments_file = fragments_file
         self.fragments_dataset = fragments_dataset
+        self.num_threads = num_threads
+        self.max_cached_rois = max_cached_rois
+
+        self.merge_hierarchy = None
+        if merge_hierarchy is not None:
+            self.merge_hierarchy = MergeHierarchy(merge_hierarchy)
+
+        self.fragments = None
+        self.rag_provider = None
+        self.executor = None
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
 
     def get_local_segmentation(self, roi: daisy.Roi, threshold: float):
-        # open fragments
-        fragments = daisy.open_ds(self.fragments_file, self.fragments_dataset)
-
-        # open RAG DB
-        rag_provider = MongoDbRagProvider(
-            self.fragments_db,
-            host=self.fragments_host,
-            mode="r",
-            edges_collection=self.edges_collection,
+
+        segmentation, fragment_ids, rag = self.__read(roi)
+
+        if self.merge_hierarchy is not None:
+            segmentation.data = self.merge_hierarchy.get_segment_ids(
+                fragment_ids,
+                threshold,
+            )
+            return segmentation
+
+        labels = rag.get_component_labels(threshold)
+
+        # fragments not in the RAG are set to 0
+        segmentation.data = relabel_fragments(
+            fragment_ids,
+            rag.node_ids,
+            labels.astype(np.uint64) + 1,
         )
 
-        segmentation = fragments[roi]
-        segmentation.materialize()
-        ids = [int(id) for id in list(np.unique(segmentation.data))]
-        rag = rag_provider.read_rag(ids)
+        return segmentation
 
-        if len(rag.nodes()) == 0:
-            raise Exception('RAG is empty')
+    def get_local_segmentations(
+        self,
+        rois,
+        threshold: float,
+        batch_size: int = 32,
+    ):
+        '''Extract the segmentations of many ROIs for the same threshold.
+
+        ROIs are processed in batches of ``batch_size``. The fragments of a
+        batch are read concurrently by ``num_threads`` threads, while the
+        previous batch is processed. Each batch needs a single RAG query for
+        the fragments of all its ROIs, and a single connected components
+        pass.
+
+        Yields ``(roi, segmentation)`` in the order of ``rois``, as soon as
+        the segmentation of an ROI is extracted.
+        '''
+
+        rois = list(rois)
+        batches = [
+            rois[b:b + batch_size]
+            for b in range(0, len(rois), batch_size)
+        ]
 
-        components = rag.get_connected_components(threshold)
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
 
-        values_map = np.array(
-            [
-                [fragment, i]
-                for i in range(1, len(components)+1)
-                for fragment in components[i-1]
-            ],
-            dtype=np.uint64,
+            def prefetch(batch):
+                return [
+                    executor.submit(self.__read_fragments, roi)
+                    for roi in batch
+                ]
+
+            pending = prefetch(batches[0]) if batches else []
+
+            for b, batch in enumerate(batches):
+
+                fragments = [future.result() for future in pending]
+
+                # read the next batch while this one is processed
+                if b + 1 < len(batches):
+                    pending = prefetch(batches[b + 1])
+
+                segmentations = self.__segment_batch(fragments, threshold)
+                for roi, segmentation in zip(batch, segmentations):
+                    yield roi, segmentation
+
+    def submit(self, roi: daisy.Roi, threshold: float):
+        '''Request the segmentation of ``roi`` for ``threshold``, to be
+        computed in a thread pool. Returns a ``concurrent.futures.Future``
+        for the segmentation.'''
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.num_threads)
+
+        return self.executor.submit(
+            self.get_local_segmentation,
+            roi,
+            threshold,
         )
-        old_values = values_map[:, 0]
-        new_values = values_map[:, 1]
-        replace_values(
-            segmentation.data, old_values, new_values, inplace=True
+
+    def close(self):
+        '''Wait for pending requests and stop the thread pool.'''
+
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+
+        if executor is not None:
+            executor.shutdown()
+
+    def __read(self, roi):
+        '''Get the fragments in ``roi`` (as a new array), and the sub-RAG of
+        these fragments (shared with other requests, not to be modified).
+        The sub-RAG is not read if a merge hierarchy is used.'''
+
+        cached = None
+        if self.max_cached_rois > 0:
+            key = self.__cache_key(roi)
+            with self.lock:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.cache.move_to_end(key)
+
+        if cached is None:
+
+            segmentation = self.__read_fragments(roi)
+
+            if self.merge_hierarchy is None:
+                rag = self.__read_rag(np.unique(segmentation.data))
+            else:
+                rag = None
+
+            cached = (segmentation, rag)
+
+            if self.max_cached_rois > 0:
+                with self.lock:
+                    self.__add(roi, cached)
+
+        segmentation, rag = cached
+        fragment_ids = segmentation.data
+
+        segmentation = daisy.Array(
+            np.zeros_like(fragment_ids),
+            segmentation.roi,
+            segmentation.voxel_size,
         )
 
-        return segmentation
+        return segmentation, fragment_ids, rag
+
+    def __segment_batch(self, fragments, threshold):
+        '''Relabel a list of fragment arrays, using one sub-RAG for all of
+        them.'''
+
+        if self.merge_hierarchy is not None:
+            for segmentation in fragments:
+                segmentation.data = self.merge_hierarchy.get_segment_ids(
+                    segmentation.data,
+                    threshold,
+                )
+                yield segmentation
+            return
+
+        ids = np.unique(np.concatenate([
+            np.unique(segmentation.data)
+            for segmentation in fragments
+        ]))
+        rag = self.__read_rag(ids)
+
+        labels = rag.get_component_labels(threshold)
+        segments = labels.astype(np.uint64) + 1
+
+        for segmentation in fragments:
+            segmentation.data = relabel_fragments(
+                segmentation.data,
+                rag.node_ids,
+                segments,
+            )
+            yield segmentation
+
+    def __read_fragments(self, roi):
+
+        fragments = self.__get_fragments()[roi]
+        fragments.materialize()
+
+        return fragments
+
+    def __read_rag(self, ids):
+
+        rag = self.__get_rag_provider().read_rag(ids.tolist())
+
+        if len(rag.nodes()) == 0:
+            raise Exception('RAG is empty')
+
+        return ColumnarRag.from_rag(rag)
+
+    def __add(self, roi, cached):
+
+        key = self.__cache_key(roi)
+        self.cache[key] = cached
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.max_cached_rois:
+            (begin, shape), _ = self.cache.popitem(last=False)
+            logger.debug(
+                "evicted ROI at %s of shape %s from cache",
+                begin,
+                shape,
+            )
+
+    def __cache_key(self, roi):
+
+        # ROIs are not hashable
+        return (tuple(roi.get_begin()), tuple(roi.get_shape()))
+
+    def __get_fragments(self):
+
+        with self.lock:
+            if self.fragments is None:
+                self.fragments = daisy.open_ds(
+                    self.fragments_file,
+                    self.fragments_dataset,
+                )
+
+        return self.fragments
+
+    def __get_rag_provider(self):
+
+        with self.lock:
+            if self.rag_provider is None:
+                self.rag_provider = MongoDbRagProvider(
+                    self.fragments_db,
+                    host=self.fragments_host,
+                    mode="r",
+                    edges_collection=self.edges_collection,
+                )
 
+        return self.rag_provider
@@ -0,0 +1,77 @@
+import numpy as np
+
+cimport cython
+from libc.stdint cimport int64_t
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def build_merge_forest(
+        int64_t[:] u,
+        int64_t[:] v,
+        double[:] scores,
+        int64_t num_nodes):
+    '''Merge nodes along edges sorted by score (Kruskal's algorithm) and
+    record the merges as a forest.
+
+    Each merge of two components links the root of the smaller one to the
+    root of the larger one. Scores along a path to a root are therefore
+    non-decreasing, and paths are at most ``log2(num_nodes)`` long. Edges
+    with a score of ``NaN`` (sorted last) are not merged.
+
+    Returns the parent of each node (itself for roots), and the score at
+    which each node was linked to its parent (``inf`` for roots).
+    '''
+
+    parents_array = np.arange(num_nodes, dtype=np.int64)
+    merge_scores_array = np.full((num_nodes,), np.inf, dtype=np.float64)
+
+    # union-find with path halving, separate from the forest to keep the
+    # forest's paths intact
+    roots_array = np.arange(num_nodes, dtype=np.int64)
+    sizes_array = np.ones((num_nodes,), dtype=np.int64)
+
+    cdef int64_t[:] parents = parents_array
+    cdef double[:] merge_scores = merge_scores_array
+    cdef int64_t[:] roots = roots_array
+    cdef int64_t[:] sizes = sizes_array
+
+    cdef int64_t num_edges = u.shape[0]
+    cdef int64_t i, a, b, t
+    cdef double score
+
+    with nogil:
+
+        for i in range(num_edges):
+
+            score = scores[i]
+            if score != score:
+                break
+
+            a = find_root(roots, u[i])
+            b = find_root(roots, v[i])
+            if a == b:
+                continue
+
+            if sizes[a] > sizes[b]:
+                t = a
+                a = b
+                b = t
+
+            parents[a] = b
+            merge_scores[a] = score
+            roots[a] = b
+            sizes[b] += sizes[a]
+
+    return parents_array, merge_scores_array
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline int64_t find_root(int64_t[:] roots, int64_t node) nogil:
+
+    while roots[node] != node:
+        roots[node] = roots[roots[node]]
+        node = roots[node]
+
+    return node
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+from .find_segments import read_sorted_edges
+from .merge_forest import build_merge_forest
+import logging
+import numpy as np
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class MergeHierarchy(object):
+    '''The segments of a RAG for all thresholds at once, stored as a forest
+    of merges of fragments.
+
+    Create a hierarchy once with :func:`create`, after all edges got their
+    ``merge_score``. Afterwards, the segment of any fragment for any
+    threshold can be found by following the merges of the fragment up to the
+    threshold, without reading the RAG again.
+
+    The forest is stored as ``.npy`` files in a directory, which are
+    memory-mapped when opened.
+
+    Args:
+
+        directory (``string``):
+
+            The directory the hierarchy was stored in by :func:`create`.
+    '''
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        self.fragments = np.load(
+            os.path.join(directory, 'fragments.npy'),
+            mmap_mode='r')
+        self.parents = np.load(
+            os.path.join(directory, 'parents.npy'),
+            mmap_mode='r')
+        self.merge_scores = np.load(
+            os.path.join(directory, 'merge_scores.npy'),
+            mmap_mode='r')
+
+    @staticmethod
+    def create(rag_provider, directory, roi=None):
+        '''Create the merge hierarchy of the RAG in ``rag_provider`` (or of
+        the nodes in ``roi`` and their neighbors) and store it in
+        ``directory``.'''
+
+        fragments, u, v, scores = read_sorted_edges(rag_provider, roi)
+
+        start = time.time()
+        parents, merge_scores = build_merge_forest(
+            u,
+            v,
+            scores,
+            len(fragments))
+        logger.info(
+            "built merge forest of %d fragments in %.3fs",
+            len(fragments), time.time() - start)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        np.save(os.path.join(directory, 'fragments.npy'), fragments)
+        np.save(os.path.join(directory, 'parents.npy'), parents)
+        np.save(os.path.join(directory, 'merge_scores.npy'), merge_scores)
+
+        return MergeHierarchy(directory)
+
+    def get_segment_ids(self, fragment_ids, threshold):
+        '''Get the segment ID of each of the given fragment IDs (an array of
+        any shape) for ``threshold``. Segment IDs are the same for all
+        requests with the same threshold. Fragments not in the hierarchy get
+        segment ID 0.'''
+
+        fragment_ids = np.asarray(fragment_ids, dtype=np.uint64)
+
+        if len(self.fragments) == 0:
+            return np.zeros(fragment_ids.shape, dtype=np.uint64)
+
+        # look up each fragment only once
+        values, inverse = np.unique(fragment_ids, return_inverse=True)
+
+        indices = np.searchsorted(self.fragments, values)
+        indices[indices == len(self.fragments)] = 0
+        found = self.fragments[indices] == values
+
+        # climb up the forest along merges up to threshold
+        nodes = indices[found]
+        while True:
+            merged = self.merge_scores[nodes] <= threshold
+            if not merged.any():
+                break
+            nodes[merged] = self.parents[nodes[merged]]
+
+        segments = np.zeros((len(values),), dtype=np.uint64)
+        segments[found] = nodes.astype(np.uint64) + 1
+
+        return segments[inverse].reshape(fragment_ids.shape)
@@ -1,3 +1,4 @@
+from .block_pipeline import run_pipelined_worker
 from .merge_tree import MergeTree
 from funlib.segment.arrays import relabel
 import daisy
@@ -15,9 +16,16 @@ def parallel_aff_agglomerate(
         context,
         merge_function,
         threshold,
-        num_workers):
+        num_workers,
+        pipeline_depth=0):
     '''Agglomerate fragments in parallel using ``waterz``.
 
+    Finished blocks are recorded in ``rag_provider`` and skipped when running
+    again. RAGs written by earlier versions have no such records: if no block
+    is recorded for this stage, the RAG itself is checked for results of
+    each block, and blocks found done are recorded. This happens only on the
+    first run after upgrading, which should be allowed to finish.
+
     Args:
 
         affs (`class:daisy.Array`):
@@ -52,6 +60,15 @@ def parallel_aff_agglomerate(
 
             The number of parallel workers.
 
+        pipeline_depth (``int``):
+
+            If larger than 0, each worker reads the inputs of the next
+            ``pipeline_depth`` blocks and writes the results of previous
+            blocks in background threads, while processing the current block.
+            Each worker flushes ``rag_provider`` after its last block, such
+            that a `class:BufferedRagProvider` can combine the writes of
+            several blocks.
+
     Returns:
 
         True, if all tasks succeeded.
@@ -66,27 +83,51 @@ def parallel_aff_agglomerate(
     read_roi = daisy.Roi((0,)*affs.roi.dims(), block_size).grow(context, context)
     write_roi = daisy.Roi((0,)*affs.roi.dims(), block_size)
 
-    return daisy.run_blockwise(
+    blocks_done = rag_provider.read_blocks_done('aff_agglomerate')
+    logger.info("%d blocks are already done", len(blocks_done))
+
+    # RAGs written before finished blocks were recorded have no entries
+    check_rag = len(blocks_done) == 0
+    if check_rag:
+        logger.info("no blocks recorded as done, checking the RAG instead")
+
+    process_function = lambda: run_pipelined_worker(
+        lambda b: _read_block(affs, fragments, rag_provider, b),
+        lambda b, data: _process_block(b, data, merge_function, threshold),
+        lambda b, rag: _write_block(b, rag, rag_provider),
+        pipeline_depth,
+        flush=rag_provider.flush)
+
+    succeeded = daisy.run_blockwise(
         total_roi,
         read_roi,
         write_roi,
-        lambda b: agglomerate_in_block(
-            affs,
-            fragments,
-            rag_provider,
-            b,
-            merge_function,
-            threshold),
-        lambda b: block_done(b, rag_provider),
+        process_function,
+        lambda b: block_done(b, blocks_done, rag_provider, check_rag),
         num_workers=num_workers,
         read_write_conflict=False,
         fit='shrink')
 
-def block_done(block, rag_provider):
+    # blocks found done by block_done are recorded in this process
+    rag_provider.flush()
+
+    return succeeded
+
+def block_done(block, blocks_done, rag_provider, check_rag=False):
+    '''Check whether ``block`` is recorded as done. If ``check_rag`` is set,
+    a block not recorded is done if the RAG has edges or no nodes in it, and
+    is then recorded.'''
+
+    if block.block_id in blocks_done:
+        return True
 
-    return (
-        rag_provider.has_edges(block.write_roi) or
-        rag_provider.num_nodes(block.write_roi) == 0)
+    if check_rag and (
+            rag_provider.has_edges(block.write_roi) or
+            rag_provider.num_nodes(block.write_roi) == 0):
+        rag_provider.mark_block_done('aff_agglomerate', block.block_id)
+        return True
+
+    return False
 
 def agglomerate_in_block(
         affs,
@@ -96,15 +137,39 @@ def agglomerate_in_block(
         merge_function,
         threshold):
 
-    logger.info(
-        "Agglomerating in block %s with context of %s",
-        block.write_roi, block.read_roi)
+    data = _read_block(affs, fragments, rag_provider, block)
+    rag = _process_block(block, data, merge_function, threshold)
+    _write_block(block, rag, rag_provider)
+
+def _read_block(affs, fragments, rag_provider, block):
+
+    if rag_provider.num_nodes(block.write_roi) == 0:
+        return None
 
     # get the sub-{affs, fragments, graph} to work on
     affs = affs.intersect(block.read_roi)
     fragments = fragments.to_ndarray(affs.roi, fill_value=0)
     rag = rag_provider[affs.roi]
 
+    # convert affs to float32 ndarray with values between 0 and 1
+    affs = affs.to_ndarray()[0:3]
+    if affs.dtype == np.uint8:
+        affs = affs.astype(np.float32)/255.0
+
+    return affs, fragments, rag
+
+def _process_block(block, data, merge_function, threshold):
+
+    logger.info(
+        "Agglomerating in block %s with context of %s",
+        block.write_roi, block.read_roi)
+
+    if data is None:
+        logger.info("no fragments in %s, skipping", block.write_roi)
+        return None
+
+    affs, fragments, rag = data
+
     # waterz uses memory proportional to the max label in fragments, therefore
     # we relabel them here and use those
     fragments_relabelled, n, fragment_relabel_map = relabel(
@@ -115,11 +180,6 @@ def agglomerate_in_block(
     logger.debug("fragments shape: %s", fragments.shape)
     logger.debug("fragments num: %d", n)
 
-    # convert affs to float32 ndarray with values between 0 and 1
-    affs = affs.to_ndarray()[0:3]
-    if affs.dtype == np.uint8:
-        affs = affs.astype(np.float32)/255.0
-
     # So far, 'rag' does not contain any edges belonging to write_roi (there
     # might be a few edges from neighboring blocks, though). Run waterz until
     # threshold 0 to get the waterz RAG, which tells us which nodes are
@@ -173,6 +233,16 @@ def agglomerate_in_block(
 
     logger.info("merged %d edges", num_merged)
 
+    return rag
+
+def _write_block(block, rag, rag_provider):
+
+    if rag is None:
+        rag_provider.mark_block_done('aff_agglomerate', block.block_id)
+        return
+
     # write back results (only within write_roi)
     logger.debug("writing to DB...")
-    rag.write_edges(block.write_roi)
+    rag.write_edges(
+        block.write_roi,
+        done=('aff_agglomerate', block.block_id))
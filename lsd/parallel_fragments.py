@@ -1,5 +1,7 @@
 from __future__ import division
+from .block_pipeline import run_pipelined_worker
 from .fragments import watershed_from_affinities
+from .rag_extraction import find_node_statistics
 from funlib.segment.arrays import relabel, replace_values
 from scipy.ndimage import measurements
 import daisy
@@ -47,9 +49,17 @@ def parallel_watershed(
         num_workers,
         fragments_in_xy=False,
         epsilon_agglomerate=0,
-        mask=None):
+        mask=None,
+        pipeline_depth=0,
+        num_threads=1):
     '''Extract fragments from affinities using watershed.
 
+    Finished blocks are recorded in ``rag_provider`` and skipped when running
+    again. RAGs written by earlier versions have no such records: if no block
+    is recorded for this stage, the RAG itself is checked for results of
+    each block, and blocks found done are recorded. This happens only on the
+    first run after upgrading, which should be allowed to finish.
+
     Args:
 
         affs (`class:daisy.Array`):
@@ -92,6 +102,20 @@ def parallel_watershed(
             A dataset containing a mask. If given, fragments are only extracted
             for masked-in (==1) areas.
 
+        pipeline_depth (``int``):
+
+            If larger than 0, each worker reads the inputs of the next
+            ``pipeline_depth`` blocks and writes the results of previous
+            blocks in background threads, while processing the current block.
+            Each worker flushes ``rag_provider`` after its last block, such
+            that a `class:BufferedRagProvider` can combine the writes of
+            several blocks.
+
+        num_threads (``int``):
+
+            The number of threads each worker uses to extract fragments of
+            xy-sections in parallel, if ``fragments_in_xy`` is set.
+
     Returns:
 
         True, if all tasks succeeded.
@@ -108,26 +132,58 @@ def parallel_watershed(
     read_roi = daisy.Roi((0,)*affs.roi.dims(), block_size).grow(context, context)
     write_roi = daisy.Roi((0,)*affs.roi.dims(), block_size)
 
-    return daisy.run_blockwise(
-        total_roi,
-        read_roi,
-        write_roi,
-        lambda b: watershed_in_block(
-            affs,
+    blocks_done = rag_provider.read_blocks_done('watershed')
+    logger.info("%d blocks are already done", len(blocks_done))
+
+    # RAGs written before finished blocks were recorded have no entries
+    check_rag = len(blocks_done) == 0
+    if check_rag:
+        logger.info("no blocks recorded as done, checking the RAG instead")
+
+    process_function = lambda: run_pipelined_worker(
+        lambda b: _read_block(affs, mask, b),
+        lambda b, data: _process_block(
             b,
-            rag_provider,
-            fragments_out,
+            data,
             fragments_in_xy,
             epsilon_agglomerate,
-            mask),
-        lambda b: block_done(b, rag_provider),
+            num_threads=num_threads),
+        lambda b, result: _write_block(
+            b,
+            result,
+            rag_provider,
+            fragments_out),
+        pipeline_depth,
+        flush=rag_provider.flush)
+
+    succeeded = daisy.run_blockwise(
+        total_roi,
+        read_roi,
+        write_roi,
+        process_function,
+        lambda b: block_done(b, blocks_done, rag_provider, check_rag),
         num_workers=num_workers,
         read_write_conflict=False,
         fit='shrink')
 
-def block_done(block, rag_provider):
+    # blocks found done by block_done are recorded in this process
+    rag_provider.flush()
+
+    return succeeded
+
+def block_done(block, blocks_done, rag_provider, check_rag=False):
+    '''Check whether ``block`` is recorded as done. If ``check_rag`` is set,
+    a block not recorded is done if the RAG has nodes in it, and is then
+    recorded.'''
+
+    if block.block_id in blocks_done:
+        return True
 
-    return rag_provider.num_nodes(block.write_roi) > 0
+    if check_rag and rag_provider.num_nodes(block.write_roi) > 0:
+        rag_provider.mark_block_done('watershed', block.block_id)
+        return True
+
+    return False
 
 def watershed_in_block(
         affs,
@@ -138,7 +194,8 @@ def watershed_in_block(
         epsilon_agglomerate,
         mask,
         filter_fragments=0.0,
-        min_seed_distance=10):
+        min_seed_distance=10,
+        num_threads=1):
     '''
 
     Args:
@@ -152,9 +209,25 @@ def watershed_in_block(
 
             Controls distance between seeds in the initial watershed. Reducing
             this value improves downsampled segmentation.
+
+        num_threads (int):
+
+            The number of threads to extract fragments of xy-sections in
+            parallel, if ``fragments_in_xy`` is set.
     '''
 
-    total_roi = affs.roi
+    data = _read_block(affs, mask, block)
+    result = _process_block(
+        block,
+        data,
+        fragments_in_xy,
+        epsilon_agglomerate,
+        filter_fragments,
+        min_seed_distance,
+        num_threads)
+    _write_block(block, result, rag_provider, fragments_out)
+
+def _read_block(affs, mask, block):
 
     logger.debug("reading affs from %s", block.read_roi)
 
@@ -168,10 +241,27 @@ def watershed_in_block(
     else:
         max_affinity_value = 1.0
 
+    mask_data = None
     if mask is not None:
 
         logger.debug("reading mask from %s", block.read_roi)
         mask_data = get_mask_data_in_roi(mask, affs.roi, affs.voxel_size)
+
+    return affs, mask_data, max_affinity_value
+
+def _process_block(
+        block,
+        data,
+        fragments_in_xy,
+        epsilon_agglomerate,
+        filter_fragments=0.0,
+        min_seed_distance=10,
+        num_threads=1):
+
+    affs, mask_data, max_affinity_value = data
+
+    if mask_data is not None:
+
         logger.debug("masking affinities")
         affs.data *= mask_data
 
@@ -180,9 +270,10 @@ def watershed_in_block(
         affs.data,
         max_affinity_value,
         fragments_in_xy=fragments_in_xy,
-        min_seed_distance=min_seed_distance)
+        min_seed_distance=min_seed_distance,
+        num_threads=num_threads)
 
-    if mask is not None:
+    if mask_data is not None:
         fragments_data *= mask_data.astype(np.uint64)
 
     if filter_fragments > 0:
@@ -252,25 +343,33 @@ def watershed_in_block(
     id_bump = block.block_id*num_voxels_in_block
     logger.debug("bumping fragment IDs by %i", id_bump)
     fragments.data[fragments.data>0] += id_bump
-    fragment_ids = range(id_bump + 1, id_bump + 1 + n)
-
-    # store fragments
-    logger.debug("writing fragments to %s", block.write_roi)
-    fragments_out[block.write_roi] = fragments
 
     # following only makes a difference if fragments were found
     if n == 0:
-        return
+        return fragments, {}
 
     # get fragment centers
+    labels, _, centers, _, _ = find_node_statistics(fragments.data)
     fragment_centers = {
-        fragment: block.write_roi.get_offset() + affs.voxel_size*center
-        for fragment, center in zip(
-            fragment_ids,
-            measurements.center_of_mass(fragments.data, fragments.data, fragment_ids))
-        if not np.isnan(center[0])
+        fragment: block.write_roi.get_offset() + affs.voxel_size*tuple(center)
+        for fragment, center in zip(labels.tolist(), centers.tolist())
+        if fragment != 0
     }
 
+    return fragments, fragment_centers
+
+def _write_block(block, result, rag_provider, fragments_out):
+
+    fragments, fragment_centers = result
+
+    # store fragments
+    logger.debug("writing fragments to %s", block.write_roi)
+    fragments_out[block.write_roi] = fragments
+
+    if len(fragment_centers) == 0:
+        rag_provider.mark_block_done('watershed', block.block_id)
+        return
+
     # store nodes
     rag = rag_provider[block.write_roi]
     rag.add_nodes_from([
@@ -282,4 +381,4 @@ def watershed_in_block(
         )
         for node, c in fragment_centers.items()
     ])
-    rag.write_nodes(block.write_roi)
+    rag.write_nodes(block.write_roi, done=('watershed', block.block_id))
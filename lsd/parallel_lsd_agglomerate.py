@@ -1,10 +1,11 @@
 from __future__ import absolute_import
 from .agglomerate import LsdAgglomeration
+from .block_pipeline import run_pipelined_worker
 from .merge_tree import MergeTree
+from .rag import Rag
 import daisy
 import logging
 import numpy as np
-import skimage.future
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +16,16 @@ def parallel_lsd_agglomerate(
         lsd_extractor,
         block_size,
         context,
-        num_workers):
+        num_workers,
+        pipeline_depth=0):
     '''Agglomerate fragments in parallel using only the shape descriptors.
 
+    Finished blocks are recorded in ``rag_provider`` and skipped when running
+    again. RAGs written by earlier versions have no such records: if no block
+    is recorded for this stage, the RAG itself is checked for results of
+    each block, and blocks found done are recorded. This happens only on the
+    first run after upgrading, which should be allowed to finish.
+
     Args:
 
         lsds (`class:daisy.Array`):
@@ -49,6 +57,15 @@ def parallel_lsd_agglomerate(
 
             The number of parallel workers.
 
+        pipeline_depth (``int``):
+
+            If larger than 0, each worker reads the inputs of the next
+            ``pipeline_depth`` blocks and writes the results of previous
+            blocks in background threads, while processing the current block.
+            Each worker flushes ``rag_provider`` after its last block, such
+            that a `class:BufferedRagProvider` can combine the writes of
+            several blocks.
+
     Returns:
 
         True, if all tasks succeeded.
@@ -63,25 +80,51 @@ def parallel_lsd_agglomerate(
     read_roi = daisy.Roi((0,)*lsds.roi.dims(), block_size).grow(context, context)
     write_roi = daisy.Roi((0,)*lsds.roi.dims(), block_size)
 
-    return daisy.run_blockwise(
+    blocks_done = rag_provider.read_blocks_done('lsd_agglomerate')
+    logger.info("%d blocks are already done", len(blocks_done))
+
+    # RAGs written before finished blocks were recorded have no entries
+    check_rag = len(blocks_done) == 0
+    if check_rag:
+        logger.info("no blocks recorded as done, checking the RAG instead")
+
+    process_function = lambda: run_pipelined_worker(
+        lambda b: _read_block(lsds, fragments, rag_provider, b),
+        lambda b, data: _process_block(b, data, lsd_extractor),
+        lambda b, rag: _write_block(b, rag, rag_provider),
+        pipeline_depth,
+        flush=rag_provider.flush)
+
+    succeeded = daisy.run_blockwise(
         total_roi,
         read_roi,
         write_roi,
-        lambda b: agglomerate_in_block(
-            lsds,
-            fragments,
-            rag_provider,
-            lsd_extractor,
-            b),
-        lambda b: block_done(b, rag_provider),
+        process_function,
+        lambda b: block_done(b, blocks_done, rag_provider, check_rag),
         num_workers=num_workers,
         read_write_conflict=False,
         fit='shrink')
 
-def block_done(block, rag_provider):
+    # blocks found done by block_done are recorded in this process
+    rag_provider.flush()
+
+    return succeeded
 
-    rag = rag_provider[block.write_roi]
-    return rag.number_of_edges() > 0 or rag.number_of_nodes() <= 1
+def block_done(block, blocks_done, rag_provider, check_rag=False):
+    '''Check whether ``block`` is recorded as done. If ``check_rag`` is set,
+    a block not recorded is done if the RAG has edges or at most one node in
+    it, and is then recorded.'''
+
+    if block.block_id in blocks_done:
+        return True
+
+    if check_rag and (
+            rag_provider.has_edges(block.write_roi) or
+            rag_provider.num_nodes(block.write_roi) <= 1):
+        rag_provider.mark_block_done('lsd_agglomerate', block.block_id)
+        return True
+
+    return False
 
 def agglomerate_in_block(
         lsds,
@@ -90,9 +133,14 @@ def agglomerate_in_block(
         lsd_extractor,
         block):
 
-    logger.info(
-        "Agglomerating in block %s with context of %s",
-        block.write_roi, block.read_roi)
+    data = _read_block(lsds, fragments, rag_provider, block)
+    rag = _process_block(block, data, lsd_extractor)
+    _write_block(block, rag, rag_provider)
+
+def _read_block(lsds, fragments, rag_provider, block):
+
+    if rag_provider.num_nodes(block.write_roi) <= 1:
+        return None
 
     # get the sub-{lsds, fragments, graph} to work on
     lsds = lsds.intersect(block.read_roi)
@@ -101,10 +149,24 @@ def agglomerate_in_block(
     voxel_size = lsds.voxel_size
     lsds = lsds.to_ndarray()
 
+    return lsds, fragments, rag, voxel_size
+
+def _process_block(block, data, lsd_extractor):
+
+    logger.info(
+        "Agglomerating in block %s with context of %s",
+        block.write_roi, block.read_roi)
+
+    if data is None:
+        logger.info("nothing to agglomerate in %s, skipping", block.write_roi)
+        return None
+
+    lsds, fragments, rag, voxel_size = data
+
     # So far, 'rag' does not contain any edges belonging to write_roi (there
     # might be a few edges from neighboring blocks, though). Use the fragments
     # to get an initial RAG (merge_rag) which we also use for agglomeration.
-    merge_rag = skimage.future.graph.RAG(fragments)
+    merge_rag = Rag(fragments, connectivity=1)
 
     # Keep the original RAG edges
     for (u, v) in merge_rag.edges():
@@ -139,5 +201,15 @@ def agglomerate_in_block(
 
     logger.info("merged %d edges", num_merged)
 
+    return rag
+
+def _write_block(block, rag, rag_provider):
+
+    if rag is None:
+        rag_provider.mark_block_done('lsd_agglomerate', block.block_id)
+        return
+
     # write back results (only within write_roi)
-    rag.sync_edges(block.write_roi)
+    rag.sync_edges(
+        block.write_roi,
+        done=('lsd_agglomerate', block.block_id))
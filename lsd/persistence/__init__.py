@@ -1,3 +1,7 @@
 from __future__ import absolute_import
 from .sqlite_rag_provider import SqliteRagProvider
+from .sharded_sqlite_rag_provider import ShardedSqliteRagProvider
+from .file_rag_provider import FileRagProvider
 from .mongodb_rag_provider import MongoDbRagProvider
+from .cached_rag_provider import CachedRagProvider
+from .buffered_rag_provider import BufferedRagProvider
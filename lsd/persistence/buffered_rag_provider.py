@@ -0,0 +1,288 @@
+from __future__ import absolute_import
+from ..shared_rag_provider import SharedRagProvider
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class BufferedRagProvider(SharedRagProvider):
+    '''Wraps a `class:SharedRagProvider` and collects written nodes and edges,
+    to write them in large batches from a background thread.
+
+    Sub-RAGs read through this provider write to the buffer. The buffer is
+    flushed when it holds ``max_rows`` nodes and edges, or ``max_delay``
+    seconds after the first row was added, and by calling :func:`flush` or
+    :func:`close`. The provider can also be used as a context manager, which
+    closes it on exit.
+
+    Buffered writes are not flushed when the process exits, since daisy
+    workers exit without running ``atexit`` handlers. The parallel
+    processing functions of this package flush their provider at the end of
+    each worker. Other users have to call :func:`flush` or :func:`close`
+    themselves.
+
+    Blocks marked as done (through the ``done`` argument of the sub-RAG's
+    ``sync_*`` methods, or through :func:`mark_block_done`) are marked only
+    after all nodes and edges buffered until then have been written. A block
+    is therefore never recorded as done before its results are stored. If a
+    write fails, everything not written stays buffered. The error is raised
+    by :func:`flush` and :func:`close`, and by further writes until a flush
+    succeeds.
+
+    Reads go directly to the wrapped provider and do not see buffered writes.
+
+    Args:
+
+        provider (`class:SharedRagProvider`):
+
+            The provider to read from and write to.
+
+        max_rows (``int``, optional):
+
+            Flush as soon as this many nodes and edges are buffered.
+
+        max_delay (``float``, optional):
+
+            Flush at the latest this many seconds after a row was buffered.
+    '''
+
+    def __init__(self, provider, max_rows=100000, max_delay=10.0):
+
+        self.provider = provider
+        self.read_only = provider.read_only
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+
+        self.lock = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+        self.__reset()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    def __getitem__(self, roi):
+
+        rag = self.provider[roi]
+        rag.provider = self
+
+        return rag
+
+    def num_nodes(self, roi):
+
+        return self.provider.num_nodes(roi)
+
+    def has_edges(self, roi):
+
+        return self.provider.has_edges(roi)
+
+    def read_rag(self, ids):
+
+        rag = self.provider.read_rag(ids)
+        rag.provider = self
+
+        return rag
+
+    def read_columnar_rag(self, roi):
+
+        return self.provider.read_columnar_rag(roi)
+
+    def read_nodes_array(self, roi=None):
+
+        return self.provider.read_nodes_array(roi)
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+
+        return self.provider.read_edges_array(roi, attrs)
+
+    def read_blocks_done(self, stage):
+
+        return self.provider.read_blocks_done(stage)
+
+    def is_block_done(self, stage, block_id):
+
+        return self.provider.is_block_done(stage, block_id)
+
+    def insert_nodes(self, nodes, done=None):
+
+        # copy the attributes, the sub-RAG might change after the sync
+        self.__buffer(
+            [(node, dict(data)) for node, data in nodes],
+            [],
+            done)
+
+    def insert_edges(self, edges, done=None):
+
+        self.__buffer(
+            [],
+            [(u, v, dict(data)) for u, v, data in edges],
+            done)
+
+    def mark_block_done(self, stage, block_id):
+
+        self.__buffer([], [], (stage, block_id))
+
+    def flush(self):
+        '''Write all buffered nodes and edges, then mark the blocks that were
+        marked as done until now. Returns after the writes finished.
+
+        If a write fails, everything not written yet stays in the buffer (to
+        be written by the next flush) and the error is raised.'''
+
+        with self.flush_lock:
+
+            with self.lock:
+
+                self.__check_process()
+                nodes, edges, done = self.nodes, self.edges, self.done
+                first_buffered = self.first_buffered
+                self.nodes, self.edges, self.done = [], [], []
+                self.first_buffered = None
+
+            if len(nodes) + len(edges) + len(done) > 0:
+                logger.debug(
+                    "flushing %d nodes, %d edges, and %d blocks",
+                    len(nodes), len(edges), len(done))
+
+            try:
+
+                if len(nodes) > 0:
+                    self.provider.insert_nodes(nodes)
+                    nodes = []
+                if len(edges) > 0:
+                    self.provider.insert_edges(edges)
+                    edges = []
+                while len(done) > 0:
+                    self.provider.mark_block_done(*done[0])
+                    done = done[1:]
+
+            except Exception:
+
+                # put back what was not written, before rows buffered since
+                with self.lock:
+                    self.nodes = nodes + self.nodes
+                    self.edges = edges + self.edges
+                    self.done = done + self.done
+                    self.first_buffered = first_buffered
+                raise
+
+            with self.lock:
+                self.error = None
+
+    def close(self):
+        '''Stop the background thread and flush.'''
+
+        with self.lock:
+            thread = self.thread if self.pid == os.getpid() else None
+            self.stopped = True
+            self.lock.notify()
+
+        if thread is not None:
+            thread.join()
+            with self.lock:
+                self.thread = None
+
+        self.flush()
+
+    def __buffer(self, nodes, edges, done):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        self.__raise_error()
+
+        with self.lock:
+
+            self.__check_process()
+            self.__start_thread()
+
+            self.nodes += nodes
+            self.edges += edges
+            if done is not None:
+                self.done.append(done)
+
+            if self.first_buffered is None:
+                self.first_buffered = time.time()
+
+            self.lock.notify()
+
+    def __start_thread(self):
+
+        if self.thread is not None:
+            return
+
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__flush_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __flush_loop(self):
+
+        while True:
+
+            with self.lock:
+
+                while not self.stopped and not self.__flush_due():
+                    if self.first_buffered is None:
+                        timeout = None
+                    else:
+                        timeout = max(
+                            0,
+                            self.first_buffered + self.max_delay -
+                            time.time())
+                    self.lock.wait(timeout)
+
+                if self.stopped:
+                    return
+
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("flushing RAG writes failed")
+                # the rows stay buffered, writes raise until a flush succeeds
+                with self.lock:
+                    self.error = e
+                    self.thread = None
+                return
+
+    def __flush_due(self):
+
+        if self.first_buffered is None:
+            return False
+
+        return (
+            len(self.nodes) + len(self.edges) >= self.max_rows or
+            time.time() >= self.first_buffered + self.max_delay)
+
+    def __check_process(self):
+
+        # After a fork, the background thread and the buffered rows belong to
+        # the parent process.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = None
+            self.__reset()
+
+    def __reset(self):
+
+        self.nodes = []
+        self.edges = []
+        self.done = []
+        self.first_buffered = None
+        self.stopped = False
+        self.error = None
+
+    def __raise_error(self):
+
+        if self.error is not None:
+            raise RuntimeError(
+                "A previous flush of RAG writes failed: %s"%self.error)
@@ -0,0 +1,239 @@
+from __future__ import absolute_import
+from ..shared_rag_provider import SharedRagProvider
+from collections import OrderedDict
+from daisy import Coordinate
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CachedRagProvider(SharedRagProvider):
+    '''Wraps a `class:SharedRagProvider` and keeps the most recently read
+    sub-RAGs in memory.
+
+    Reads of an ROI contained in a cached ROI are served from the cache.
+    Returned sub-RAGs are copies, which can be modified and synced as usual.
+    Their writes go through this provider, which drops all cached sub-RAGs
+    that contain any of the written nodes or edges.
+
+    Only writes through this provider invalidate the cache, writes of other
+    processes are not seen.
+
+    Args:
+
+        provider (`class:SharedRagProvider`):
+
+            The provider to read from and write to.
+
+        max_bytes (``int``, optional):
+
+            The approximate memory budget of the cache. If exceeded, the least
+            recently used sub-RAGs are dropped.
+    '''
+
+    # rough estimates of the memory used by a node or an edge (including
+    # their attribute dictionaries) in a sub-RAG
+    node_bytes = 500
+    edge_bytes = 700
+
+    def __init__(self, provider, max_bytes=1024**3):
+
+        self.provider = provider
+        self.read_only = provider.read_only
+        self.max_bytes = max_bytes
+
+        # (roi, sub-RAG, size) by ROI offset and shape
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self, roi):
+
+        cached = self.__find_cached(roi)
+
+        if cached is None:
+
+            cached = self.provider[roi]
+
+            with self.lock:
+                self.__add(roi, cached)
+
+        return self.__extract(cached, roi)
+
+    def num_nodes(self, roi):
+
+        cached = self.__find_cached(roi)
+
+        if cached is None:
+            return self.provider.num_nodes(roi)
+
+        return len(self.__nodes_in_roi(cached, roi))
+
+    def has_edges(self, roi):
+
+        cached = self.__find_cached(roi)
+
+        if cached is None:
+            return self.provider.has_edges(roi)
+
+        return any(
+            True
+            for _ in cached.edges(self.__nodes_in_roi(cached, roi)))
+
+    def read_rag(self, ids):
+
+        rag = self.provider.read_rag(ids)
+        rag.provider = self
+
+        return rag
+
+    def read_columnar_rag(self, roi):
+
+        return self.provider.read_columnar_rag(roi)
+
+    def read_nodes_array(self, roi=None):
+
+        return self.provider.read_nodes_array(roi)
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+
+        return self.provider.read_edges_array(roi, attrs)
+
+    def insert_nodes(self, nodes, done=None):
+
+        nodes = list(nodes)
+        self.__invalidate(
+            (node for node, _ in nodes),
+            [
+                Coordinate((
+                    data['center_z'],
+                    data['center_y'],
+                    data['center_x']))
+                for _, data in nodes
+                if 'center_z' in data
+            ])
+        self.provider.insert_nodes(nodes, done=done)
+
+    def insert_edges(self, edges, done=None):
+
+        edges = list(edges)
+        self.__invalidate(node for u, v, _ in edges for node in [u, v])
+        self.provider.insert_edges(edges, done=done)
+
+    def mark_block_done(self, stage, block_id):
+
+        self.provider.mark_block_done(stage, block_id)
+
+    def read_blocks_done(self, stage):
+
+        return self.provider.read_blocks_done(stage)
+
+    def is_block_done(self, stage, block_id):
+
+        return self.provider.is_block_done(stage, block_id)
+
+    def flush(self):
+
+        self.provider.flush()
+
+    def clear(self):
+        '''Drop all cached sub-RAGs.'''
+
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def __find_cached(self, roi):
+        '''Get a cached sub-RAG of an ROI containing ``roi``, or ``None``.'''
+
+        with self.lock:
+
+            for key, (cached_roi, rag, _) in self.cache.items():
+
+                if cached_roi.contains(roi):
+
+                    self.cache.move_to_end(key)
+                    logger.debug("serving %s from cached %s", roi, cached_roi)
+
+                    return rag
+
+        return None
+
+    def __add(self, roi, rag):
+
+        size = (
+            rag.number_of_nodes()*self.node_bytes +
+            rag.number_of_edges()*self.edge_bytes)
+
+        if size > self.max_bytes:
+            logger.debug("sub-RAG in %s too large to cache", roi)
+            return
+
+        key = self.__key(roi)
+        if key in self.cache:
+            self.cache_bytes -= self.cache.pop(key)[2]
+
+        self.cache[key] = (roi, rag, size)
+        self.cache_bytes += size
+
+        while self.cache_bytes > self.max_bytes:
+            _, (evicted_roi, _, evicted_size) = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted_size
+            logger.debug("evicted %s from cache", evicted_roi)
+
+    def __invalidate(self, nodes, centers=()):
+        '''Drop cached sub-RAGs that contain any of ``nodes``, or whose ROI
+        contains any of ``centers``.'''
+
+        nodes = set(nodes)
+
+        with self.lock:
+
+            for key, (roi, rag, size) in list(self.cache.items()):
+
+                # conservatively, any sub-RAG containing a written node or
+                # a node of a written edge is dropped, even if it does not
+                # contain the edge itself; new nodes are found by their
+                # centers
+                if (
+                        any(rag.has_node(node) for node in nodes) or
+                        any(roi.contains(center) for center in centers)):
+                    del self.cache[key]
+                    self.cache_bytes -= size
+
+    def __key(self, roi):
+
+        # ROIs are not hashable
+        return (tuple(roi.get_begin()), tuple(roi.get_shape()))
+
+    def __nodes_in_roi(self, rag, roi):
+
+        return [
+            node
+            for node, data in rag.nodes(data=True)
+            if 'center_z' in data and roi.contains(Coordinate((
+                data['center_z'],
+                data['center_y'],
+                data['center_x'])))
+        ]
+
+    def __extract(self, cached, roi):
+        '''Copy the sub-RAG in ``roi`` out of a cached sub-RAG of a larger
+        ROI.'''
+
+        nodes = self.__nodes_in_roi(cached, roi)
+
+        rag = type(cached)(self.provider)
+        rag.provider = self
+
+        rag.add_nodes_from(
+            (node, dict(cached.node[node]))
+            for node in nodes)
+
+        # neighbors outside of roi are added without attributes, as if they
+        # had been read from the provider
+        rag.add_edges_from(
+            (u, v, dict(data))
+            for u, v, data in cached.edges(nodes, data=True))
+
+        return rag
@@ -0,0 +1,561 @@
+from __future__ import absolute_import
+from ..columnar_rag import ColumnarRag
+from ..shared_rag_provider import SharedRagProvider, SubRag
+from daisy import Coordinate
+import itertools
+import json
+import logging
+import numpy as np
+import os
+import re
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+# makes shard names unique within a process
+_shard_counter = itertools.count()
+
+class FileSubRag(SubRag):
+
+    def __init__(self, provider):
+
+        super(SubRag, self).__init__()
+
+        self.provider = provider
+        self.read_only = provider.read_only
+
+    def _contains(self, roi, edge):
+
+        u, v = edge
+        min_node = self.node[u]
+
+        # Some nodes are outside of the originally requested ROI (they have
+        # been pulled in by edges leaving the ROI). These nodes have no
+        # attributes, so we can't perform an inclusion test. However, we
+        # know they are outside of the sub-RAG ROI, and therefore also
+        # outside of 'roi', whatever it is.
+        if 'center_z' not in min_node:
+            return False
+
+        min_node_center = Coordinate((
+            min_node['center_z'],
+            min_node['center_y'],
+            min_node['center_x']))
+
+        return roi.contains(min_node_center)
+
+    def sync_edges(self, roi, done=None):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        logger.debug("Writing edges in %s", roi)
+
+        self.provider.insert_edges(
+            (
+                (u, v, data)
+                for u, v, data in self.edges(data=True)
+                if self._contains(roi, (min(u, v), max(u, v)))
+            ),
+            done=done)
+
+    def sync_nodes(self, done=None):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        logger.debug("Writing all nodes")
+
+        # nodes pulled in by edges leaving the ROI have no attributes
+        self.provider.insert_nodes(
+            (
+                (node, data)
+                for node, data in self.nodes(data=True)
+                if len(data) > 0
+            ),
+            done=done)
+
+class FileRagProvider(SharedRagProvider):
+    '''A shared region adjacency graph stored as a directory of ``.npy``
+    files, without the need for a database.
+
+    Each write (usually one per block) adds a new shard: a structured array
+    of nodes or edges, and a small JSON manifest holding the bounding box of
+    the node centers or the range of node IDs in the shard. Writers never
+    wait for each other. Readers keep an index of the manifests to find the
+    shards relevant for a query, and memory-map only those.
+
+    If a node or edge is written several times, the last write wins. Nodes
+    have to have a center, and are assumed to keep it.
+
+    Blocks marked as done are stored as empty files
+    ``blocks_done/<stage>/<block_id>``, created after the nodes or edges of
+    the block have been written.
+
+    Args:
+
+        directory (``string``):
+
+            The directory to store the shards in.
+
+        mode (``string``):
+
+            One of ``r`` (read-only), ``r+`` (read and write), or ``w``
+            (start with an empty RAG).
+    '''
+
+    # columns of node shards
+    node_dtype = [
+        ('id', np.uint64),
+        ('center_z', np.float64),
+        ('center_y', np.float64),
+        ('center_x', np.float64)
+    ]
+
+    # columns of edge shards, merge scores of None are stored as NaN
+    edge_dtype = [
+        ('u', np.uint64),
+        ('v', np.uint64),
+        ('merge_score', np.float64),
+        ('agglomerated', np.uint8)
+    ]
+
+    manifest_pattern = re.compile(r'^(\d+)_(\d+)_(\d+)\.(nodes|edges)\.json$')
+
+    def __init__(self, directory, mode):
+
+        self.directory = directory
+        self.read_only = mode == 'r'
+
+        # shards are never modified, their manifests can be kept
+        self.manifests = {}
+
+        # the shards and their bounds, see __get_index
+        self.index = {}
+
+        if not self.read_only and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if mode == 'w':
+
+            # start with a fresh RAG
+            for shard, kind in self.__list_shards():
+                os.remove(self.__shard_filename(shard, kind, 'npy'))
+                os.remove(self.__shard_filename(shard, kind, 'json'))
+            if os.path.isdir(self.__blocks_done_dirname()):
+                shutil.rmtree(self.__blocks_done_dirname())
+
+    def __getitem__(self, roi):
+
+        assert roi.dims() == 3, "Sorry, FileRagProvider does only 3D"
+
+        nodes = self.__read_nodes_in_roi(roi)
+        edges = self.__read_edges(nodes['id'])
+
+        return self.__to_sub_rag(nodes, edges)
+
+    def num_nodes(self, roi):
+
+        assert roi.dims() == 3, "Sorry, FileRagProvider does only 3D"
+
+        return len(self.__read_nodes_in_roi(roi))
+
+    def has_edges(self, roi):
+
+        assert roi.dims() == 3, "Sorry, FileRagProvider does only 3D"
+
+        nodes = self.__read_nodes_in_roi(roi)
+
+        return len(self.__read_edges(nodes['id'])) > 0
+
+    def read_rag(self, ids):
+
+        ids = np.unique(np.asarray(ids, dtype=np.uint64))
+
+        nodes = self.__read(
+            'nodes',
+            lambda index: self.__overlaps(ids, index['id_range']),
+            lambda shard: np.isin(shard['id'], ids))
+        edges = self.__read_edges(ids)
+
+        return self.__to_sub_rag(nodes, edges)
+
+    def read_columnar_rag(self, roi):
+
+        assert roi.dims() == 3, "Sorry, FileRagProvider does only 3D"
+
+        nodes = self.__read_nodes_in_roi(roi)
+        edges = self.__read_edges(nodes['id'])
+
+        return ColumnarRag(
+            node_ids=nodes['id'],
+            node_centers=np.stack([
+                nodes['center_z'],
+                nodes['center_y'],
+                nodes['center_x']
+            ], axis=1),
+            edges_u=edges['u'],
+            edges_v=edges['v'],
+            merge_score=edges['merge_score'],
+            agglomerated=edges['agglomerated'])
+
+    def read_nodes_array(self, roi=None):
+
+        if roi is None:
+            nodes = self.__read(
+                'nodes',
+                lambda index: True,
+                lambda shard: slice(None))
+        else:
+            assert roi.dims() == 3, "Sorry, FileRagProvider does only 3D"
+            nodes = self.__read_nodes_in_roi(roi)
+
+        return self._split_columns(nodes, self.node_columns)
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+
+        for attr in attrs:
+            assert attr in [name for name, _ in self.edge_dtype[2:]], (
+                "unknown edge attribute %s"%attr)
+
+        if roi is None:
+            edges = self.__read(
+                'edges',
+                lambda index: True,
+                lambda shard: slice(None))
+        else:
+            assert roi.dims() == 3, "Sorry, FileRagProvider does only 3D"
+            edges = self.__read_edges(self.__read_nodes_in_roi(roi)['id'])
+
+        return self._split_columns(edges, self._edge_columns(attrs))
+
+    def insert_nodes(self, nodes, done=None):
+        '''Write nodes, given as ``(id, data)`` tuples, as a new shard. Nodes
+        have to have a center. If ``done`` is given as ``(stage, block_id)``,
+        mark the block as done after the write.'''
+
+        nodes = list(nodes)
+        for node, data in nodes:
+            if 'center_z' not in data:
+                raise RuntimeError(
+                    "node %d has no center, FileRagProvider can only store "
+                    "nodes with center"%node)
+
+        nodes = np.array(
+            [
+                (
+                    node,
+                    data['center_z'],
+                    data['center_y'],
+                    data['center_x']
+                )
+                for node, data in nodes
+            ],
+            dtype=self.node_dtype)
+
+        if len(nodes) > 0:
+            self.__write_nodes(nodes)
+
+        if done is not None:
+            self.mark_block_done(*done)
+
+    def insert_edges(self, edges, done=None):
+        '''Write edges, given as ``(u, v, data)`` tuples, as a new shard. If
+        ``done`` is given as ``(stage, block_id)``, mark the block as done
+        after the write.'''
+
+        edges = np.array(
+            [
+                (
+                    min(u, v), max(u, v),
+                    np.nan
+                    if data.get('merge_score') is None
+                    else data['merge_score'],
+                    1 if data.get('agglomerated') else 0
+                )
+                for u, v, data in edges
+            ],
+            dtype=self.edge_dtype)
+
+        if len(edges) > 0:
+            self.__write_edges(edges)
+
+        if done is not None:
+            self.mark_block_done(*done)
+
+    def mark_block_done(self, stage, block_id):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        dirname = os.path.join(self.__blocks_done_dirname(), stage)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by another process in the meantime
+                pass
+
+        open(os.path.join(dirname, '%d'%block_id), 'w').close()
+
+    def read_blocks_done(self, stage):
+
+        dirname = os.path.join(self.__blocks_done_dirname(), stage)
+        if not os.path.isdir(dirname):
+            return set()
+
+        return set(int(block_id) for block_id in os.listdir(dirname))
+
+    def is_block_done(self, stage, block_id):
+
+        return os.path.exists(os.path.join(
+            self.__blocks_done_dirname(),
+            stage,
+            '%d'%block_id))
+
+    def __write_nodes(self, nodes):
+
+        centers = np.stack([
+            nodes['center_z'],
+            nodes['center_y'],
+            nodes['center_x']
+        ], axis=1)
+
+        self.__write_shard(
+            'nodes',
+            nodes,
+            {
+                'bbox_min': centers.min(axis=0).tolist(),
+                'bbox_max': centers.max(axis=0).tolist(),
+                'id_range': [
+                    int(nodes['id'].min()),
+                    int(nodes['id'].max())
+                ]
+            })
+
+    def __write_edges(self, edges):
+
+        self.__write_shard(
+            'edges',
+            edges,
+            {
+                'u_range': [int(edges['u'].min()), int(edges['u'].max())],
+                'v_range': [int(edges['v'].min()), int(edges['v'].max())]
+            })
+
+    def __read_nodes_in_roi(self, roi):
+
+        begin = roi.get_begin()
+        end = roi.get_end()
+
+        def in_roi(shard):
+            mask = np.ones((len(shard),), dtype=np.bool_)
+            for dim, b, e in zip(['z', 'y', 'x'], begin, end):
+                center = shard['center_%s'%dim]
+                mask &= (center >= b) & (center < e)
+            return mask
+
+        return self.__read(
+            'nodes',
+            lambda index: (
+                np.all(index['bbox_max'] >= begin, axis=1) &
+                np.all(index['bbox_min'] < end, axis=1)),
+            in_roi)
+
+    def __read_edges(self, ids):
+        '''Read all edges with ``u`` or ``v`` in the sorted array ``ids``.'''
+
+        return self.__read(
+            'edges',
+            lambda index: (
+                self.__overlaps(ids, index['u_range']) |
+                self.__overlaps(ids, index['v_range'])),
+            lambda shard: (
+                np.isin(shard['u'], ids) |
+                np.isin(shard['v'], ids)))
+
+    def __read(self, kind, select_shards, select_rows):
+        '''Read the rows selected by ``select_rows`` from the shards of
+        ``kind`` selected by ``select_shards``, a function returning a mask
+        over the shards given their index (see :func:`__get_index`).'''
+
+        dtype = self.node_dtype if kind == 'nodes' else self.edge_dtype
+
+        shards, index = self.__get_index(kind)
+        selected = np.zeros((len(shards),), dtype=np.bool_)
+        if len(shards) > 0:
+            selected[:] = select_shards(index)
+
+        rows = [np.zeros((0,), dtype=dtype)]
+        num_shards = 0
+
+        for shard in itertools.compress(shards, selected):
+
+            data = np.load(
+                self.__shard_filename(shard, kind, 'npy'),
+                mmap_mode='r')
+            rows.append(np.array(data[select_rows(data)]))
+            num_shards += 1
+
+        rows = np.concatenate(rows)
+
+        # keep the last write of each node or edge (shards are listed in the
+        # order they were written)
+        if kind == 'nodes':
+            keys = rows['id'][::-1]
+        else:
+            keys = np.stack([rows['u'], rows['v']], axis=1)[::-1]
+        _, last = np.unique(keys, axis=0, return_index=True)
+        rows = rows[len(rows) - 1 - last]
+
+        logger.debug("read %d %s from %d shards", len(rows), kind, num_shards)
+
+        return rows
+
+    def __to_sub_rag(self, nodes, edges):
+
+        graph = FileSubRag(self)
+
+        graph.add_nodes_from(
+            (
+                node,
+                {
+                    'center_z': z,
+                    'center_y': y,
+                    'center_x': x
+                }
+            )
+            for node, z, y, x in zip(
+                nodes['id'].tolist(),
+                nodes['center_z'].tolist(),
+                nodes['center_y'].tolist(),
+                nodes['center_x'].tolist()))
+
+        graph.add_edges_from(
+            (
+                u, v,
+                {
+                    'merge_score': score if not np.isnan(score) else None,
+                    'agglomerated': agglomerated
+                }
+            )
+            for u, v, score, agglomerated in zip(
+                edges['u'].tolist(),
+                edges['v'].tolist(),
+                edges['merge_score'].tolist(),
+                edges['agglomerated'].tolist()))
+
+        return graph
+
+    def __overlaps(self, ids, id_ranges):
+        '''Check for each of the (inclusive) ``id_ranges``, an array of shape
+        ``(n, 2)``, whether any of the sorted ``ids`` is in it.'''
+
+        return (
+            np.searchsorted(ids, id_ranges[:, 0], side='left') <
+            np.searchsorted(ids, id_ranges[:, 1], side='right'))
+
+    def __write_shard(self, kind, rows, manifest):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        shard = (
+            int(time.time()*1e6),
+            os.getpid(),
+            next(_shard_counter))
+
+        # Write to temporary files first and rename them, such that readers
+        # never see partial shards. The manifest is moved last, a shard does
+        # not exist for readers before.
+        for extension, write in [
+                ('npy', lambda f: np.save(f, rows)),
+                ('json', lambda f: f.write(json.dumps(manifest).encode()))]:
+
+            filename = self.__shard_filename(shard, kind, extension)
+            with open(filename + '.tmp', 'wb') as f:
+                write(f)
+            os.replace(filename + '.tmp', filename)
+
+        logger.debug("wrote %d %s to shard %s", len(rows), kind, shard)
+
+    def __get_index(self, kind):
+        '''Get the shards of ``kind`` in the order they were written, and the
+        bounds stored in their manifests as arrays (one row per shard).
+
+        The index is kept until the directory changes, such that reads do not
+        scale with the total number of shards. Listings taken within a second
+        of a change are not trusted, since the modification time of the
+        directory might not change for writes in quick succession.'''
+
+        mtime = None
+        if os.path.isdir(self.directory):
+            mtime = os.stat(self.directory).st_mtime
+
+        cached = self.index.get(kind)
+        if cached is not None:
+            cached_mtime, listed_at, shards, index = cached
+            if cached_mtime == mtime and listed_at - mtime > 1.0:
+                return shards, index
+
+        listed_at = time.time()
+        shards = [
+            shard
+            for shard, shard_kind in self.__list_shards()
+            if shard_kind == kind
+        ]
+        manifests = [self.__get_manifest(shard, kind) for shard in shards]
+
+        if kind == 'nodes':
+            keys = [('bbox_min', 3), ('bbox_max', 3), ('id_range', 2)]
+        else:
+            keys = [('u_range', 2), ('v_range', 2)]
+
+        index = {
+            key: np.array(
+                [manifest[key] for manifest in manifests],
+                dtype=np.float64 if key.startswith('bbox') else np.uint64
+            ).reshape((-1, size))
+            for key, size in keys
+        }
+
+        if mtime is not None:
+            self.index[kind] = (mtime, listed_at, shards, index)
+
+        return shards, index
+
+    def __get_manifest(self, shard, kind):
+
+        if (shard, kind) not in self.manifests:
+            with open(self.__shard_filename(shard, kind, 'json'), 'r') as f:
+                self.manifests[(shard, kind)] = json.load(f)
+
+        return self.manifests[(shard, kind)]
+
+    def __list_shards(self):
+        '''Get ``(shard, kind)`` of all complete shards, in the order they
+        were written.'''
+
+        shards = []
+        if not os.path.isdir(self.directory):
+            return shards
+
+        for filename in os.listdir(self.directory):
+            match = self.manifest_pattern.match(filename)
+            if match is not None:
+                shards.append((
+                    tuple(int(i) for i in match.groups()[:3]),
+                    match.group(4)))
+
+        return sorted(shards)
+
+    def __blocks_done_dirname(self):
+
+        return os.path.join(self.directory, 'blocks_done')
+
+    def __shard_filename(self, shard, kind, extension):
+
+        return os.path.join(
+            self.directory,
+            '%d_%d_%d.%s.%s'%(shard + (kind, extension)))
@@ -1,33 +1,49 @@
 from __future__ import absolute_import
+from ..columnar_rag import ColumnarRag
 from ..shared_rag_provider import SharedRagProvider, SubRag
 from networkx.convert import to_dict_of_dicts
 from daisy import Coordinate
-from pymongo import MongoClient, IndexModel, ASCENDING
+from pymongo import MongoClient, IndexModel, UpdateOne, ASCENDING
 from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 import logging
+import numpy as np
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+# MongoClients are thread-safe and maintain their own connection pool, but
+# must not be used across forks. Share one client per process and host.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_client(host, max_pool_size):
+
+    key = (os.getpid(), host, max_pool_size)
+
+    with _clients_lock:
+
+        if key not in _clients:
+
+            logger.debug(
+                "creating MongoClient for %s in process %d",
+                host, key[0])
+            _clients[key] = MongoClient(
+                host,
+                maxPoolSize=max_pool_size,
+                connect=False)
+
+        return _clients[key]
+
 class MongoDbSubRag(SubRag):
 
-    def __init__(
-            self,
-            db_name,
-            host=None,
-            mode='r+',
-            nodes_collection='nodes',
-            edges_collection='edges'):
+    def __init__(self, provider):
 
         super(SubRag, self).__init__()
 
-        self.db_name = db_name
-        self.host = host
-        self.mode = mode
-
-        self.client = MongoClient(self.host)
-        self.database = self.client[db_name]
-        self.nodes_collection = self.database[nodes_collection]
-        self.edges_collection = self.database[edges_collection]
+        self.provider = provider
+        self.read_only = provider.mode == 'r'
 
     def _contains(self, roi, edge):
 
@@ -49,141 +65,185 @@ class MongoDbSubRag(SubRag):
 
         return roi.contains(min_node_center)
 
-    def sync_edges(self, roi):
+    def sync_edges(self, roi, done=None):
 
-        if self.mode == 'r':
+        if self.read_only:
             raise RuntimeError("Trying to write to read-only DB")
 
         logger.debug("Writing edges in %s", roi)
 
-        edges = []
-        for u, v, data in self.edges(data=True):
+        self.provider.insert_edges(
+            (
+                (u, v, data)
+                for u, v, data in self.edges(data=True)
+                if self._contains(roi, (min(u, v), max(u, v)))
+            ),
+            done=done)
 
-            u, v = min(u, v), max(u, v)
-            if not self._contains(roi, (u, v)):
-                continue
+    def sync_nodes(self, done=None):
 
-            edge = {
-                'u': int(u),
-                'v': int(v),
-            }
-            edge.update(data)
-            edges.append(edge)
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
 
-        if len(edges) == 0:
-            return
+        logger.debug("Writing all nodes")
 
-        try:
+        # nodes pulled in by edges leaving the ROI have no attributes
+        self.provider.insert_nodes(
+            (
+                (node, data)
+                for node, data in self.nodes(data=True)
+                if len(data) > 0
+            ),
+            done=done)
 
-            self.edges_collection.insert_many(edges)
+class MongoDbRagProvider(SharedRagProvider):
+    '''A shared region adjacency graph stored in a MongoDB.
 
-        except BulkWriteError as e:
+    Args:
 
-            logger.error(e.details)
-            raise
+        db_name (``string``):
 
-    def sync_nodes(self):
+            The name of the MongoDB database.
 
-        if self.mode == 'r':
-            raise RuntimeError("Trying to write to read-only DB")
+        host (``string``, optional):
 
-        logger.debug("Writing all nodes")
+            The MongoDB host to connect to.
 
-        nodes = []
-        for node_id, data in self.nodes(data=True):
+        mode (``string``, optional):
 
-            node = {
-                'id': int(node_id)
-            }
-            node.update(data)
-            nodes.append(node)
+            One of ``r`` (read-only), ``r+`` (read and write, default), or
+            ``w`` (start with an empty RAG).
 
-        if len(nodes) == 0:
-            return
+        nodes_collection, edges_collection (``string``, optional):
 
-        try:
+            The names of the collections to store nodes and edges in.
 
-            self.nodes_collection.insert_many(nodes)
+        max_pool_size (``int``, optional):
 
-        except BulkWriteError as e:
+            The largest number of connections to open to ``host``. All
+            providers of a process share one ``MongoClient`` (and its
+            connection pool) per host, which is kept open between calls.
 
-            logger.error(e.details)
-            raise
+        write_concern (``dict``, optional):
 
-class MongoDbRagProvider(SharedRagProvider):
-    '''A shared region adjacency graph stored in an SQLite file.
+            The write concern for nodes and edges, e.g., ``{'w': 1}``. See
+            ``pymongo.write_concern.WriteConcern``. Defaults to the write
+            concern of the database.
+
+        write_mode (``string``, optional):
+
+            How to write nodes and edges: ``insert`` (default) fails on nodes
+            and edges that are already stored, ``upsert`` updates the written
+            attributes and keeps all others. With ``upsert``, writing the
+            same block twice (e.g., when a failed block is retried) is
+            harmless, and the server is free to apply the writes of a batch
+            in any order.
+
+        write_batch_size (``int``, optional):
+
+            The largest number of nodes or edges to send in one request.
+
+        blocks_done_collection (``string``, optional):
+
+            The name of the collection to store blocks marked as done in. A
+            block is marked after its nodes or edges have been written.
     '''
 
+    # the fields identifying a document, for upserts
+    document_keys = {
+        'nodes': ['id'],
+        'edges': ['u', 'v']
+    }
+
+    # the number of documents to transfer per batch when reading arrays
+    read_batch_size = 100000
+
     def __init__(
             self,
             db_name,
             host=None,
             mode='r+',
             nodes_collection='nodes',
-            edges_collection='edges'):
+            edges_collection='edges',
+            max_pool_size=100,
+            write_concern=None,
+            write_mode='insert',
+            write_batch_size=10000,
+            blocks_done_collection='blocks_done'):
+
+        assert write_mode in ['insert', 'upsert'], (
+            "write_mode has to be 'insert' or 'upsert'")
 
         self.db_name = db_name
         self.host = host
         self.mode = mode
+        self.read_only = mode == 'r'
+        self.max_pool_size = max_pool_size
+        self.write_concern = write_concern
+        self.write_mode = write_mode
+        self.write_batch_size = write_batch_size
         self.nodes_collection_name = nodes_collection
         self.edges_collection_name = edges_collection
-        self.client = None
-        self.database = None
-        self.nodes = None
-        self.edges = None
-
-        try:
-
-            self.__connect()
-            self.__open_db()
-
-            if mode == 'w':
-
-                logger.info(
-                    "dropping collections %s and %s",
-                    self.nodes_collection_name,
-                    self.edges_collection_name)
-
-                self.__open_collections()
-                self.nodes.drop()
-                self.edges.drop()
-
-            if (
-                    nodes_collection not in self.database.collection_names() or
-                    edges_collection not in self.database.collection_names()):
-                self.__create_collections()
-
-        finally:
-
-            self.__disconnect()
-
-    def __connect(self):
-
-        self.client = MongoClient(self.host)
+        self.blocks_done_collection_name = blocks_done_collection
+
+        database = self.__open_db()
+
+        if mode == 'w':
+
+            logger.info(
+                "dropping collections %s and %s",
+                self.nodes_collection_name,
+                self.edges_collection_name)
+
+            self.__open_collection('nodes').drop()
+            self.__open_collection('edges').drop()
+            self.__open_collection('blocks_done').drop()
+
+        if (
+                nodes_collection not in database.collection_names() or
+                edges_collection not in database.collection_names()):
+            self.__create_collections()
+        elif mode != 'r':
+            # edges of DBs created by earlier versions are not indexed by v,
+            # needed to read sub-RAGs in one query
+            self.__create_edges_v_index()
+
+        if mode != 'r':
+            self.__open_collection('blocks_done').create_index(
+                [
+                    ('stage', ASCENDING),
+                    ('block_id', ASCENDING)
+                ],
+                name='stage_block',
+                unique=True)
 
     def __open_db(self):
 
-        self.database = self.client[self.db_name]
+        return _get_client(self.host, self.max_pool_size)[self.db_name]
 
-    def __open_collections(self):
+    def __open_collection(self, name):
+        '''Get a handle of collection ``name`` (one of ``nodes``, ``edges``,
+        or ``blocks_done``).
 
-        self.nodes = self.database[self.nodes_collection_name]
-        self.edges = self.database[self.edges_collection_name]
+        Handles are not stored in the provider, but kept by the calling
+        method only. Providers can therefore be used from several threads at
+        the same time (e.g., by the reader and writer threads of
+        :func:`run_pipelined_worker`).'''
 
-    def __disconnect(self):
+        write_concern = None
+        if self.write_concern is not None:
+            write_concern = WriteConcern(**self.write_concern)
 
-        self.nodes = None
-        self.edges = None
-        self.database = None
-        self.client.close()
-        self.client = None
+        return self.__open_db().get_collection(
+            getattr(self, name + '_collection_name'),
+            write_concern=write_concern)
 
     def __create_collections(self):
 
-        self.__open_db()
-        self.__open_collections()
+        nodes = self.__open_collection('nodes')
+        edges = self.__open_collection('edges')
 
-        self.nodes.create_index(
+        nodes.create_index(
             [
                 ('center_z', ASCENDING),
                 ('center_y', ASCENDING),
@@ -191,14 +251,14 @@ class MongoDbRagProvider(SharedRagProvider):
             ],
             name='position')
 
-        self.nodes.create_index(
+        nodes.create_index(
             [
                 ('id', ASCENDING)
             ],
             name='id',
             unique=True)
 
-        self.edges.create_index(
+        edges.create_index(
             [
                 ('u', ASCENDING),
                 ('v', ASCENDING)
@@ -206,48 +266,44 @@ class MongoDbRagProvider(SharedRagProvider):
             name='incident',
             unique=True)
 
-    def __get_rag(self, nodes):
-        try:
+        self.__create_edges_v_index()
 
-            self.__connect()
-            self.__open_db()
-            self.__open_collections()
+    def __create_edges_v_index(self):
 
-            # create a list of nodes and their attributes
-            node_list = [
-                (n['id'], self.__remove_keys(n, ['id']))
-                for n in nodes
-            ]
-            logger.debug("found %d nodes", len(node_list))
-            logger.debug("read nodes: %s", node_list)
-
-            # get all edges that have their u in the selected nodes
-            node_ids = list([ node[0] for node in node_list])
-            logger.debug("looking for edges with u in %s", node_ids)
-            edges = self.edges.find(
-                {
-                    'u': { '$in': node_ids }
-                })
+        self.__open_collection('edges').create_index(
+            [
+                ('v', ASCENDING)
+            ],
+            name='v')
 
-            # create a list of edges and their attributes
-            edge_list = [
-                (e['u'], e['v'], self.__remove_keys(e, ['u', 'v']))
-                for e in edges
-            ]
-            logger.debug("found %d edges", len(edge_list))
-            logger.debug("read edges: %s", edge_list)
+    def __get_rag(self, nodes):
 
-        finally:
+        # create a list of nodes and their attributes
+        node_list = [
+            (n['id'], self.__remove_keys(n, ['id']))
+            for n in nodes
+        ]
+        logger.debug("found %d nodes", len(node_list))
+        logger.debug("read nodes: %s", node_list)
+
+        # get all edges that have their u in the selected nodes
+        node_ids = list([ node[0] for node in node_list])
+        logger.debug("looking for edges with u in %s", node_ids)
+        edges = self.__open_collection('edges').find(
+            {
+                'u': { '$in': node_ids }
+            })
 
-            self.__disconnect()
+        # create a list of edges and their attributes
+        edge_list = [
+            (e['u'], e['v'], self.__remove_keys(e, ['u', 'v']))
+            for e in edges
+        ]
+        logger.debug("found %d edges", len(edge_list))
+        logger.debug("read edges: %s", edge_list)
 
         # create the sub-RAG
-        graph = MongoDbSubRag(
-            self.db_name,
-            self.host,
-            self.mode,
-            self.nodes_collection_name,
-            self.edges_collection_name)
+        graph = MongoDbSubRag(self)
         graph.add_nodes_from(node_list)
         graph.add_edges_from(edge_list)
 
@@ -259,25 +315,8 @@ class MongoDbRagProvider(SharedRagProvider):
 
         logger.debug("Querying nodes in %s", roi)
 
-        bz, by, bx = roi.get_begin()
-        ez, ey, ex = roi.get_end()
-
-        try:
-
-            self.__connect()
-            self.__open_db()
-            self.__open_collections()
-
-            nodes = self.nodes.find(
-                {
-                    'center_z': { '$gte': bz, '$lt': ez },
-                    'center_y': { '$gte': by, '$lt': ey },
-                    'center_x': { '$gte': bx, '$lt': ex }
-                })
-
-        finally:
-
-            self.__disconnect()
+        nodes = self.__open_collection('nodes').find(
+            self.__position_query(roi))
 
         return nodes
 
@@ -287,97 +326,375 @@ class MongoDbRagProvider(SharedRagProvider):
 
         logger.debug("Querying nodes with number of ids", len(ids))
 
-        try:
+        nodes = self.__open_collection('nodes').find({
+            'id': {'$in': ids}
+        })
 
-            self.__connect()
-            self.__open_db()
-            self.__open_collections()
+        return nodes
 
-            nodes = self.nodes.find({
-                'id': {'$in': ids}
-            })
+    def num_nodes(self, roi):
 
-        finally:
+        assert roi.dims() == 3, "Sorry, MongoDbRagProvider backend does only 3D"
 
-            self.__disconnect()
+        num = self.__open_collection('nodes').count(
+            self.__position_query(roi))
 
-        return nodes
+        return num
 
-    def num_nodes(self, roi):
+    def has_edges(self, roi):
 
         assert roi.dims() == 3, "Sorry, MongoDbRagProvider backend does only 3D"
 
-        try:
+        node = self.__open_collection('nodes').find_one(
+            self.__position_query(roi))
 
-            self.__connect()
-            self.__open_db()
-            self.__open_collections()
+        # no nodes -> no edges
+        if node is None:
+            return False
 
-            bz, by, bx = roi.get_begin()
-            ez, ey, ex = roi.get_end()
+        edges = self.__open_collection('edges').find(
+            {
+                'u': node['id']
+            })
 
-            num = self.nodes.count(
-                {
-                    'center_z': { '$gte': bz, '$lt': ez },
-                    'center_y': { '$gte': by, '$lt': ey },
-                    'center_x': { '$gte': bx, '$lt': ex }
-                })
+        return edges.count() > 0
 
-        finally:
+    def read_rag(self, ids):
 
-            self.__disconnect()
+        # get all nodes with given ids
+        nodes = self.read_nodes_with_ids(ids)
 
-        return num
+        return self.__get_rag(nodes)
 
-    def has_edges(self, roi):
+    def insert_nodes(self, nodes, done=None):
+        '''Write nodes, given as ``(id, data)`` tuples. If ``done`` is given as
+        ``(stage, block_id)``, mark the block as done after the write.'''
 
-        assert roi.dims() == 3, "Sorry, MongoDbRagProvider backend does only 3D"
+        documents = []
+        for node_id, data in nodes:
+
+            node = {
+                'id': int(node_id)
+            }
+            node.update(data)
+            documents.append(node)
+
+        self.__insert_documents(documents, 'nodes')
+
+        if done is not None:
+            self.mark_block_done(*done)
+
+    def insert_edges(self, edges, done=None):
+        '''Write edges, given as ``(u, v, data)`` tuples. If ``done`` is given
+        as ``(stage, block_id)``, mark the block as done after the write.'''
+
+        documents = []
+        for u, v, data in edges:
+
+            edge = {
+                'u': int(min(u, v)),
+                'v': int(max(u, v)),
+            }
+            edge.update(data)
+            documents.append(edge)
+
+        self.__insert_documents(documents, 'edges')
+
+        if done is not None:
+            self.mark_block_done(*done)
+
+    def mark_block_done(self, stage, block_id):
+
+        if self.mode == 'r':
+            raise RuntimeError("Trying to write to read-only DB")
+
+        block = {
+            'stage': stage,
+            'block_id': int(block_id)
+        }
+
+        self.__open_collection('blocks_done').replace_one(
+            block,
+            block,
+            upsert=True)
+
+    def read_blocks_done(self, stage):
+
+        blocks_done = set(
+            block['block_id']
+            for block in self.__open_collection('blocks_done').find(
+                {'stage': stage},
+                projection={'_id': False, 'block_id': True}))
+
+        return blocks_done
+
+    def is_block_done(self, stage, block_id):
+
+        block = self.__open_collection('blocks_done').find_one(
+            {
+                'stage': stage,
+                'block_id': int(block_id)
+            })
+
+        return block is not None
+
+    def __insert_documents(self, documents, name):
+
+        if self.mode == 'r':
+            raise RuntimeError("Trying to write to read-only DB")
+
+        if len(documents) == 0:
+            return
+
+        collection = self.__open_collection(name)
 
         try:
 
-            self.__connect()
-            self.__open_db()
-            self.__open_collections()
+            for b in range(0, len(documents), self.write_batch_size):
+
+                batch = documents[b:b + self.write_batch_size]
+
+                if self.write_mode == 'upsert':
+                    collection.bulk_write(
+                        [
+                            UpdateOne(
+                                {
+                                    key: document[key]
+                                    for key in self.document_keys[name]
+                                },
+                                {'$set': document},
+                                upsert=True)
+                            for document in batch
+                        ],
+                        ordered=False)
+                else:
+                    collection.insert_many(batch)
 
-            bz, by, bx = roi.get_begin()
-            ez, ey, ex = roi.get_end()
+        except BulkWriteError as e:
 
-            node = self.nodes.find_one(
-                {
-                    'center_z': { '$gte': bz, '$lt': ez },
-                    'center_y': { '$gte': by, '$lt': ey },
-                    'center_x': { '$gte': bx, '$lt': ex }
-                })
+            logger.error(e.details)
+            raise
 
-            # no nodes -> no edges
-            if node is None:
-                return False
+    def read_columnar_rag(self, roi):
 
-            edges = self.edges.find(
-                {
-                    'u': node['id']
-                })
+        assert roi.dims() == 3, "Sorry, MongoDbRagProvider backend does only 3D"
 
-        finally:
+        return self.__read_nodes_with_edges(roi, as_columns=True)
 
-            self.__disconnect()
+    def read_nodes_array(self, roi=None):
 
-        return edges.count() > 0
+        if roi is None:
+            query = {'center_z': {'$ne': None}}
+        else:
+            assert roi.dims() == 3, (
+                "Sorry, MongoDbRagProvider backend does only 3D")
+            query = self.__position_query(roi)
 
-    def read_rag(self, ids):
+        names = [name for name, _ in self.node_columns]
 
-        # get all nodes with given ids
-        nodes = self.read_nodes_with_ids(ids)
+        nodes = self.__open_collection('nodes').find(
+            query,
+            projection=self.__projection(names),
+            batch_size=self.read_batch_size)
+        nodes = self._rows_to_columns(
+            (tuple(n.get(name) for name in names) for n in nodes),
+            self.node_columns,
+            chunk_size=self.read_batch_size)
 
-        return self.__get_rag(nodes)
+        logger.debug("read %d nodes", len(nodes['id']))
+
+        return nodes
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+
+        edge_columns = self._edge_columns(attrs)
+        names = [name for name, _ in edge_columns]
+
+        if roi is None:
+            queries = [{}]
+        else:
+            # query the edges of the nodes in roi, in batches of IDs
+            ids = self.read_nodes_array(roi)['id'].tolist()
+            queries = [
+                {
+                    '$or': [
+                        {'u': {'$in': ids[b:b + self.read_batch_size]}},
+                        {'v': {'$in': ids[b:b + self.read_batch_size]}}
+                    ]
+                }
+                for b in range(0, len(ids), self.read_batch_size)
+            ]
+
+        collection = self.__open_collection('edges')
+        edges = self._rows_to_columns(
+            (
+                tuple(e.get(name) for name in names)
+                for query in queries
+                for e in collection.find(
+                    query,
+                    projection=self.__projection(names),
+                    batch_size=self.read_batch_size)
+            ),
+            edge_columns,
+            chunk_size=self.read_batch_size)
+
+        if len(queries) > 1:
+
+            # edges between nodes of different batches are found twice
+            _, unique = np.unique(
+                np.stack([edges['u'], edges['v']], axis=1),
+                axis=0,
+                return_index=True)
+            edges = {
+                name: column[unique]
+                for name, column in edges.items()
+            }
+
+        logger.debug("read %d edges", len(edges['u']))
+
+        return edges
 
     def __getitem__(self, roi):
 
         assert roi.dims() == 3, "Sorry, MongoDbRagProvider backend does only 3D"
 
-        # get all nodes within roi
-        nodes = self.read_nodes(roi)
-        return self.__get_rag(nodes)
+        return self.__read_nodes_with_edges(roi)
+
+    def __read_nodes_with_edges(self, roi, as_columns=False):
+        '''Read the nodes in ``roi`` together with their edges in a single
+        aggregation. If ``as_columns`` is set, only the attributes stored in a
+        `class:ColumnarRag` are transferred and returned as such.'''
+
+        pipeline = [
+            {'$match': self.__position_query(roi)},
+            {
+                '$lookup': {
+                    'from': self.edges_collection_name,
+                    'localField': 'id',
+                    'foreignField': 'u',
+                    'as': 'edges_u'
+                }
+            },
+            {
+                '$lookup': {
+                    'from': self.edges_collection_name,
+                    'localField': 'id',
+                    'foreignField': 'v',
+                    'as': 'edges_v'
+                }
+            }
+        ]
+
+        if as_columns:
+            projection = {'_id': False}
+            for field in ['id', 'center_z', 'center_y', 'center_x']:
+                projection[field] = True
+            for field in ['u', 'v', 'merge_score', 'agglomerated']:
+                projection['edges_u.' + field] = True
+                projection['edges_v.' + field] = True
+        else:
+            projection = {
+                '_id': False,
+                'edges_u._id': False,
+                'edges_v._id': False
+            }
+        pipeline.append({'$project': projection})
+
+        nodes = list(self.__open_collection('nodes').aggregate(pipeline))
+
+        if as_columns:
+            return self.__to_columnar_rag(nodes)
+
+        graph = MongoDbSubRag(self)
+
+        for node in nodes:
+
+            # edges between nodes in roi are listed twice, once for each node
+            edges = node.pop('edges_u') + node.pop('edges_v')
+
+            graph.add_node(node.pop('id'), **node)
+            graph.add_edges_from(
+                (e['u'], e['v'], self.__remove_keys(e, ['u', 'v']))
+                for e in edges)
+
+        logger.debug(
+            "read %d nodes and %d edges",
+            graph.number_of_nodes(), graph.number_of_edges())
+
+        return graph
+
+    def __to_columnar_rag(self, nodes):
+
+        edges = [
+            (
+                e['u'], e['v'],
+                e.get('merge_score'),
+                e.get('agglomerated') or 0
+            )
+            for n in nodes
+            for e in n['edges_u'] + n['edges_v']
+        ]
+        nodes = np.array(
+            [
+                (n['id'], n['center_z'], n['center_y'], n['center_x'])
+                for n in nodes
+            ],
+            dtype=[
+                ('id', np.uint64),
+                ('center_z', np.float32),
+                ('center_y', np.float32),
+                ('center_x', np.float32)
+            ])
+        edges = np.array(
+            edges,
+            dtype=[
+                ('u', np.uint64),
+                ('v', np.uint64),
+                ('merge_score', np.float32),
+                ('agglomerated', np.uint8)
+            ])
+
+        # edges between nodes in roi are listed twice, once for each node
+        _, unique = np.unique(
+            np.stack([edges['u'], edges['v']], axis=1),
+            axis=0,
+            return_index=True)
+        edges = edges[unique]
+
+        logger.debug(
+            "read %d nodes and %d edges",
+            len(nodes), len(edges))
+
+        return ColumnarRag(
+            node_ids=nodes['id'],
+            node_centers=np.stack([
+                nodes['center_z'],
+                nodes['center_y'],
+                nodes['center_x']
+            ], axis=1),
+            edges_u=edges['u'],
+            edges_v=edges['v'],
+            merge_score=edges['merge_score'],
+            agglomerated=edges['agglomerated'])
+
+    def __projection(self, names):
+
+        projection = {'_id': False}
+        for name in names:
+            projection[name] = True
+
+        return projection
+
+    def __position_query(self, roi):
+
+        bz, by, bx = roi.get_begin()
+        ez, ey, ex = roi.get_end()
+
+        return {
+            'center_z': { '$gte': bz, '$lt': ez },
+            'center_y': { '$gte': by, '$lt': ey },
+            'center_x': { '$gte': bx, '$lt': ex }
+        }
 
     def __remove_keys(self, dictionary, keys):
 
@@ -0,0 +1,422 @@
+from __future__ import absolute_import
+from ..shared_rag_provider import SharedRagProvider
+from .sqlite_rag_provider import SqliteRagProvider, SqliteSubRag
+from daisy import Coordinate, Roi
+import itertools
+import logging
+import math
+import numpy as np
+import os
+import re
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+class ShardedSqliteSubRag(SqliteSubRag):
+
+    def sync_edges(self, roi, done=None):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        logger.debug("Writing edges in %s", roi)
+
+        # edges are stored in the shard of the node that owns them
+        self.provider.insert_edges(
+            (
+                (u, v, self.__located_at(min(u, v), data))
+                for u, v, data in self.edges(data=True)
+                if self._contains(roi, (min(u, v), max(u, v)))
+            ),
+            done=done)
+
+    def __located_at(self, node, data):
+
+        node_data = self.node[node]
+
+        data = dict(data)
+        for dim in ['z', 'y', 'x']:
+            data['center_%s'%dim] = node_data['center_%s'%dim]
+
+        return data
+
+class ShardedSqliteRagProvider(SharedRagProvider):
+    '''A shared region adjacency graph stored in several SQLite files, one
+    for each cube ("shard") of a regular grid. Workers writing to different
+    shards do not have to wait for each other's locks.
+
+    Nodes are stored in the shard containing their center. Edges are stored
+    in the shard of their smaller node, the same node that decides whether an
+    edge is written by :func:`SubRag.sync_edges`. Blocks marked as done are
+    stored in a separate file, after the nodes or edges of the block have
+    been written to all shards.
+
+    Args:
+
+        directory (``string``):
+
+            The directory to store the shards in, one file per shard.
+
+        mode (``string``):
+
+            One of ``r`` (read-only), ``r+`` (read and write), or ``w``
+            (start with an empty RAG).
+
+        shard_size (``tuple`` of ``int``):
+
+            The size of each shard in world units. Should be a multiple of the
+            block size of the workers writing to the RAG, such that each block
+            writes to exactly one shard.
+
+        edge_context (``tuple`` of ``int``, optional):
+
+            The largest distance between the centers of two adjacent nodes.
+            To find edges to nodes in an ROI from nodes outside of it, shards
+            within this distance to the ROI are read as well. Defaults to
+            ``shard_size``.
+
+        kwargs:
+
+            Passed on to the `class:SqliteRagProvider` of each shard.
+    '''
+
+    shard_pattern = re.compile(r'^shard_(-?\d+)_(-?\d+)_(-?\d+)\.db$')
+
+    def __init__(
+            self,
+            directory,
+            mode,
+            shard_size,
+            edge_context=None,
+            **kwargs):
+
+        self.directory = directory
+        self.read_only = mode == 'r'
+        self.shard_size = Coordinate(shard_size)
+        if edge_context is None:
+            edge_context = shard_size
+        self.edge_context = Coordinate(edge_context)
+        self.kwargs = kwargs
+        self.shards = {}
+
+        # shards known to exist, shards are never removed after __init__
+        self.stored_shards = set()
+
+        if not self.read_only and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if mode == 'w':
+
+            # start with a fresh RAG
+            for index in self.__stored_shard_indices():
+                os.remove(self.__shard_filename(index))
+            if os.path.exists(self.__blocks_done_filename()):
+                os.remove(self.__blocks_done_filename())
+            self.stored_shards.clear()
+
+        if not self.read_only:
+
+            connection = self.__connect_blocks_done()
+            try:
+                with connection:
+                    connection.execute('''
+                        CREATE TABLE IF NOT EXISTS blocks_done (
+                            stage text,
+                            block_id bigint,
+                            PRIMARY KEY (stage, block_id))
+                    ''')
+            finally:
+                connection.close()
+
+    def __getitem__(self, roi):
+
+        assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+
+        graph = ShardedSqliteSubRag(self)
+
+        for index in self.__shard_indices(roi):
+            self.__add_rag(graph, self.__get_shard(index)[roi])
+
+        # edges to nodes in roi, stored in the shard of a node in another
+        # shard
+        nodes = [
+            (node, (data['center_z'], data['center_y'], data['center_x']))
+            for node, data in graph.nodes(data=True)
+            if 'center_z' in data
+        ]
+        ids = np.array([node for node, _ in nodes], dtype=np.uint64)
+        centers = np.array(
+            [center for _, center in nodes],
+            dtype=np.float64).reshape(-1, 3)
+
+        for index, shard_ids in self.__cross_shard_ids(roi, ids, centers):
+            self.__add_rag(graph, self.__get_shard(index).read_rag(shard_ids))
+
+        return graph
+
+    def num_nodes(self, roi):
+
+        assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+
+        return sum(
+            self.__get_shard(index).num_nodes(roi)
+            for index in self.__shard_indices(roi))
+
+    def has_edges(self, roi):
+
+        assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+
+        if any(
+                self.__get_shard(index).has_edges(roi)
+                for index in self.__shard_indices(roi)):
+            return True
+
+        # all remaining edges are stored in the shards of nodes in other
+        # shards
+        nodes = self.read_nodes_array(roi)
+        ids = nodes['id']
+        centers = np.stack([
+            nodes['center_z'],
+            nodes['center_y'],
+            nodes['center_x']
+        ], axis=1).astype(np.float64)
+
+        return any(
+            self.__get_shard(index).has_edges_of_nodes(shard_ids)
+            for index, shard_ids in self.__cross_shard_ids(roi, ids, centers))
+
+    def read_rag(self, ids):
+
+        graph = ShardedSqliteSubRag(self)
+
+        for index in self.__stored_shard_indices():
+            self.__add_rag(graph, self.__get_shard(index).read_rag(ids))
+
+        return graph
+
+    def read_nodes_array(self, roi=None):
+
+        if roi is None:
+            indices = self.__stored_shard_indices()
+        else:
+            assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+            indices = self.__shard_indices(roi)
+
+        # each node is stored in exactly one shard
+        return self.__concatenate([
+            self.__get_shard(index).read_nodes_array(roi)
+            for index in indices
+        ], self.node_columns)
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+
+        if roi is not None:
+            # edges of nodes in roi can be stored in any shard within the
+            # edge context, see __getitem__
+            return super(ShardedSqliteRagProvider, self).read_edges_array(
+                roi,
+                attrs)
+
+        # each edge is stored in the shard of u
+        return self.__concatenate([
+            self.__get_shard(index).read_edges_array(attrs=attrs)
+            for index in self.__stored_shard_indices()
+        ], self._edge_columns(attrs))
+
+    def insert_nodes(self, nodes, done=None):
+        '''Write nodes, given as ``(id, data)`` tuples, to the shards
+        containing their centers. Nodes without center are skipped.'''
+
+        self.__insert(nodes, lambda node: node[1], 'insert_nodes', done)
+
+    def insert_edges(self, edges, done=None):
+        '''Write edges, given as ``(u, v, data)`` tuples, to the shards
+        containing the ``center_{z,y,x}`` in their data. Edges without center
+        are skipped.'''
+
+        self.__insert(edges, lambda edge: edge[2], 'insert_edges', done)
+
+    def mark_block_done(self, stage, block_id):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        connection = self.__connect_blocks_done()
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT OR IGNORE INTO blocks_done VALUES (?, ?)',
+                    (stage, int(block_id)))
+        finally:
+            connection.close()
+
+    def read_blocks_done(self, stage):
+
+        if not os.path.exists(self.__blocks_done_filename()):
+            return set()
+
+        connection = self.__connect_blocks_done()
+        try:
+            c = connection.cursor()
+            c.execute(
+                'SELECT block_id FROM blocks_done WHERE stage = ?',
+                (stage,))
+            blocks_done = set(row[0] for row in c)
+        finally:
+            connection.close()
+
+        return blocks_done
+
+    def __insert(self, rows, get_data, method, done):
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        rows_by_shard = {}
+        skipped = 0
+
+        for row in rows:
+
+            data = get_data(row)
+            if 'center_z' not in data:
+                skipped += 1
+                continue
+
+            index = self.__shard_index((
+                data['center_z'],
+                data['center_y'],
+                data['center_x']))
+            rows_by_shard.setdefault(index, []).append(row)
+
+        if skipped > 0:
+            logger.debug("skipped %d rows without center", skipped)
+
+        for index, shard_rows in rows_by_shard.items():
+            getattr(self.__get_shard(index), method)(shard_rows)
+            self.stored_shards.add(index)
+
+        if done is not None:
+            self.mark_block_done(*done)
+
+    def __cross_shard_ids(self, roi, ids, centers):
+        '''Get ``(index, ids)`` for each stored shard that can hold edges of
+        the given nodes in ``roi`` without holding the nodes themselves, i.e.,
+        the IDs of the nodes within the edge context of the shard but not in
+        it.'''
+
+        if len(ids) == 0:
+            return []
+
+        node_shards = np.floor(
+            centers/np.array(self.shard_size, dtype=np.float64))
+        context = np.array(self.edge_context, dtype=np.float64)
+        size = np.array(self.shard_size, dtype=np.float64)
+
+        cross_shard_ids = []
+        for index in self.__shard_indices(
+                roi.grow(self.edge_context, self.edge_context)):
+
+            begin = np.array(index, dtype=np.float64)*size
+            in_context = np.logical_and(
+                (centers >= begin - context).all(axis=1),
+                (centers < begin + size + context).all(axis=1))
+            in_shard = (node_shards == np.array(index)).all(axis=1)
+
+            shard_ids = ids[np.logical_and(in_context, ~in_shard)]
+            if len(shard_ids) > 0:
+                cross_shard_ids.append((index, shard_ids.tolist()))
+
+        return cross_shard_ids
+
+    def __add_rag(self, graph, rag):
+
+        # attributes of nodes read from several shards are merged
+        graph.add_nodes_from(rag.nodes(data=True))
+        graph.add_edges_from(rag.edges(data=True))
+
+    def __concatenate(self, arrays, columns):
+
+        if len(arrays) == 0:
+            return self._split_columns(np.zeros((0,), dtype=columns), columns)
+
+        return {
+            name: np.concatenate([a[name] for a in arrays])
+            for name in arrays[0]
+        }
+
+    def __get_shard(self, index):
+
+        if index not in self.shards:
+
+            mode = 'r' if self.read_only else 'r+'
+            self.shards[index] = SqliteRagProvider(
+                self.__shard_filename(index),
+                mode,
+                **self.kwargs)
+
+        return self.shards[index]
+
+    def __connect_blocks_done(self):
+
+        return sqlite3.connect(self.__blocks_done_filename(), timeout=300.0)
+
+    def __blocks_done_filename(self):
+
+        return os.path.join(self.directory, 'blocks_done.db')
+
+    def __shard_index(self, location):
+
+        return tuple(
+            int(math.floor(l/s))
+            for l, s in zip(location, self.shard_size))
+
+    def __shard_indices(self, roi):
+        '''Get the indices of all stored shards intersecting ``roi``.'''
+
+        begin = roi.get_begin()
+        end = roi.get_end()
+
+        if None in begin or None in end:
+            return [
+                index
+                for index in self.__stored_shard_indices()
+                if roi.intersects(
+                    Roi(self.shard_size*Coordinate(index), self.shard_size))
+            ]
+
+        candidates = itertools.product(*[
+            range(int(math.floor(b/s)), int(math.ceil(e/s)))
+            for b, e, s in zip(begin, end, self.shard_size)
+        ])
+
+        return [index for index in candidates if self.__is_stored(index)]
+
+    def __is_stored(self, index):
+
+        # other workers might have created the shard since the last check,
+        # only shards known to exist are cached
+        if index not in self.stored_shards:
+            if not os.path.exists(self.__shard_filename(index)):
+                return False
+            self.stored_shards.add(index)
+
+        return True
+
+    def __stored_shard_indices(self):
+
+        indices = []
+        if not os.path.isdir(self.directory):
+            return indices
+
+        for filename in os.listdir(self.directory):
+            match = self.shard_pattern.match(filename)
+            if match is not None:
+                indices.append(tuple(int(i) for i in match.groups()))
+
+        self.stored_shards.update(indices)
+
+        return indices
+
+    def __shard_filename(self, index):
+
+        return os.path.join(self.directory, 'shard_%d_%d_%d.db'%index)
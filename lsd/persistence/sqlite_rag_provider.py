@@ -1,21 +1,22 @@
 from __future__ import absolute_import
+from ..columnar_rag import ColumnarRag
 from ..shared_rag_provider import SharedRagProvider, SubRag
 from networkx.convert import to_dict_of_dicts
 from daisy import Coordinate
 import sqlite3
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 class SqliteSubRag(SubRag):
 
-    def __init__(self, filename, read_only, sync_edge_attributes):
+    def __init__(self, provider):
 
         super(SubRag, self).__init__()
 
-        self.filename = filename
-        self.read_only = read_only
-        self._sync_edge_attributes = sync_edge_attributes
+        self.provider = provider
+        self.read_only = provider.read_only
 
     def _contains(self, roi, edge):
 
@@ -37,73 +38,85 @@ class SqliteSubRag(SubRag):
 
         return roi.contains(min_node_center)
 
-    def sync_edges(self, roi):
+    def sync_edges(self, roi, done=None):
 
         if self.read_only:
             raise RuntimeError("Trying to write to read-only DB")
 
         logger.debug("Writing edges in %s", roi)
 
-        connection = sqlite3.connect(self.filename, timeout=300.0)
-        c = connection.cursor()
+        self.provider.insert_edges(
+            (
+                (u, v, data)
+                for u, v, data in self.edges(data=True)
+                if self._contains(roi, (min(u, v), max(u, v)))
+            ),
+            done=done)
 
-        for u, v, data in self.edges(data=True):
+    def sync_nodes(self, done=None):
 
-            u, v = min(u, v), max(u, v)
-            if not self._contains(roi, (u, v)):
-                continue
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
 
-            values = {
-                'u': u,
-                'v': v,
-            }
-            values.update(data)
+        logger.debug("Writing all nodes")
 
-            names = ', '.join(SqliteRagProvider.edge_attributes)
-            values = ', '.join([
-                str(values[key]) if values[key] is not None else 'null'
-                for key in SqliteRagProvider.edge_attributes
-            ])
+        # Nodes pulled in by edges leaving the ROI have no attributes. Writing
+        # them would replace their stored centers with NULL.
+        self.provider.insert_nodes(
+            (
+                (node, data)
+                for node, data in self.nodes(data=True)
+                if len(data) > 0
+            ),
+            done=done)
 
-            query = 'INSERT INTO edges (%s) VALUES (%s)'%(names, values)
-            logger.debug(query)
-            c.execute(query)
+class SqliteRagProvider(SharedRagProvider):
+    '''A shared region adjacency graph stored in an SQLite file.
 
-        connection.commit()
-        connection.close()
+    Args:
 
-    def sync_nodes(self):
+        filename (``string``):
 
-        if self.read_only:
-            raise RuntimeError("Trying to write to read-only DB")
+            The SQLite file to store the RAG in.
 
-        logger.debug("Writing all nodes")
+        mode (``string``):
 
-        connection = sqlite3.connect(self.filename, timeout=300.0)
-        c = connection.cursor()
+            One of ``r`` (read-only), ``r+`` (read and write), or ``w``
+            (start with an empty RAG).
 
-        for node, data in self.nodes(data=True):
+        on_conflict (``string``, optional):
 
-            values = {
-                'id': node
-            }
-            values.update(data)
+            What to do when writing a node or edge that is already stored:
+            ``replace`` (default) overwrites the stored attributes, ``ignore``
+            keeps them, and ``abort`` raises an ``sqlite3.IntegrityError``.
 
-            names = ', '.join(SqliteRagProvider.node_attributes)
-            values = ', '.join([
-                str(values[key]) if values[key] is not None else 'null'
-                for key in SqliteRagProvider.node_attributes
-            ])
+        wal (``bool``, optional):
 
-            query = 'INSERT INTO nodes (%s) VALUES (%s)'%(names, values)
-            logger.debug(query)
-            c.execute(query)
+            If set, switch the SQLite file to write-ahead logging, which lets
+            readers proceed while a block is written.
 
-        connection.commit()
-        connection.close()
+        synchronous (``string``, optional):
 
-class SqliteRagProvider(SharedRagProvider):
-    '''A shared region adjacency graph stored in an SQLite file.
+            If given, the value for SQLite's ``synchronous`` pragma, e.g.,
+            ``NORMAL``, which is safe in WAL mode and avoids a disk sync for
+            each transaction.
+
+        cache_size (``int``, optional):
+
+            If given, the value for SQLite's ``cache_size`` pragma (number of
+            pages if positive, KiB if negative).
+
+        create_indices (``bool``, optional):
+
+            Whether to create the indices on nodes and edges right away
+            (default). For bulk loads into a fresh DB, set this to ``False``
+            and call :func:`create_indices` once the load is done. Until then,
+            reads are full table scans and ``on_conflict`` has no effect.
+
+    Nodes are indexed spatially by their centers with an R*Tree, such that ROI
+    queries scale with the size of the ROI rather than the size of the DB.
+    Edges are indexed by ``u`` (through the unique ``(u, v)`` index) and
+    ``v``. Blocks marked as done are stored in the table ``blocks_done``.
     '''
 
     # all node_attributes
@@ -119,6 +132,13 @@ class SqliteRagProvider(SharedRagProvider):
         'agglomerated'
     ]
 
+    # SQL insert statements for each conflict policy
+    insert_statements = {
+        'abort': 'INSERT',
+        'ignore': 'INSERT OR IGNORE',
+        'replace': 'INSERT OR REPLACE'
+    }
+
     # edge atttributes that should be written back by
     # SubRag.sync_edge_attributes()
     sync_edge_attributes = ['merge_score', 'agglomerated']
@@ -149,14 +169,31 @@ class SqliteRagProvider(SharedRagProvider):
 
         return rag
 
-    def __init__(self, filename, mode):
+    def __init__(
+            self,
+            filename,
+            mode,
+            on_conflict='replace',
+            wal=False,
+            synchronous=None,
+            cache_size=None,
+            create_indices=True):
+
+        assert on_conflict in self.insert_statements, (
+            "on_conflict has to be one of %s"%list(self.insert_statements))
 
         self.filename = filename
         self.read_only = mode == 'r'
+        self.on_conflict = on_conflict
+        self.synchronous = synchronous
+        self.cache_size = cache_size
 
-        connection = sqlite3.connect(self.filename)
+        connection = self.__connect()
         c = connection.cursor()
 
+        if wal:
+            c.execute('PRAGMA journal_mode = WAL')
+
         if mode == 'w':
 
             # start with a fresh DB
@@ -176,6 +213,9 @@ class SqliteRagProvider(SharedRagProvider):
                 # nodes did not exist
                 pass
 
+            c.execute('DROP TABLE IF EXISTS nodes_rtree')
+            c.execute('DROP TABLE IF EXISTS blocks_done')
+
         # make sure required tables are present
         try:
 
@@ -201,131 +241,569 @@ class SqliteRagProvider(SharedRagProvider):
             # table did already exist
             pass
 
+        # registry of blocks processed by each stage
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS blocks_done (
+                stage text,
+                block_id bigint,
+                PRIMARY KEY (stage, block_id))
+        ''')
+
+        connection.commit()
+        connection.close()
+
+        if create_indices:
+            self.create_indices()
+
+    def create_indices(self):
+        '''Create the indices on nodes and edges, if they don't exist yet.'''
+
+        connection = self.__connect()
+        c = connection.cursor()
+
+        # unique indices, needed to detect conflicts on insert
+        try:
+            c.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS nodes_id ON nodes (id)')
+            c.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS edges_incident '
+                'ON edges (u, v)')
+        except sqlite3.IntegrityError:
+            logger.warning(
+                "%s contains duplicate nodes or edges, conflicts on insert "
+                "will not be detected", self.filename)
+
+        # edges_incident serves queries on u
+        c.execute('CREATE INDEX IF NOT EXISTS edges_v ON edges (v)')
+
+        if not self.__has_spatial_index(c):
+
+            logger.debug("creating spatial index for nodes")
+
+            # statements are idempotent, since several processes might open
+            # a new DB at the same time
+
+            c.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS nodes_rtree USING rtree(
+                    id,
+                    min_z, max_z,
+                    min_y, max_y,
+                    min_x, max_x)
+            ''')
+            c.execute('''
+                INSERT OR REPLACE INTO nodes_rtree
+                SELECT
+                    id,
+                    center_z, center_z,
+                    center_y, center_y,
+                    center_x, center_x
+                FROM nodes WHERE center_z IS NOT NULL
+            ''')
+
+            # keep the spatial index up-to-date
+            c.execute('''
+                CREATE TRIGGER IF NOT EXISTS nodes_rtree_insert
+                AFTER INSERT ON nodes
+                WHEN new.center_z IS NOT NULL
+                BEGIN
+                    INSERT OR REPLACE INTO nodes_rtree VALUES (
+                        new.id,
+                        new.center_z, new.center_z,
+                        new.center_y, new.center_y,
+                        new.center_x, new.center_x);
+                END
+            ''')
+            c.execute('''
+                CREATE TRIGGER IF NOT EXISTS nodes_rtree_delete
+                AFTER DELETE ON nodes
+                BEGIN
+                    DELETE FROM nodes_rtree WHERE id = old.id;
+                END
+            ''')
+
         connection.commit()
         connection.close()
 
-    def __slice_condition(self, value, start, stop):
+    def __has_spatial_index(self, cursor):
 
-        if start is None and stop is None:
-            return None
+        cursor.execute('''
+            SELECT COUNT(*) FROM sqlite_master
+            WHERE type = 'trigger' AND name = 'nodes_rtree_insert'
+        ''')
 
-        if start is None:
-            return '%s < %d'%(value, stop)
+        return cursor.fetchone()[0] > 0
 
-        if stop is None:
-            return '%s >= %d'%(value, start)
+    def __connect(self):
 
-        return '%s >= %d AND %s < %d'%(value, start, value, stop)
+        connection = sqlite3.connect(self.filename, timeout=300.0)
+
+        if self.synchronous is not None:
+            connection.execute('PRAGMA synchronous = %s'%self.synchronous)
+        if self.cache_size is not None:
+            connection.execute('PRAGMA cache_size = %d'%self.cache_size)
+
+        return connection
+
+    def __nodes_in_roi_query(self, cursor, roi, columns):
+        '''Get an SQL query (and its arguments) that selects ``columns`` of
+        all nodes in ``roi``.'''
+
+        conditions = []
+        rtree_conditions = []
+        arguments = []
+
+        for dim, s in zip(['z', 'y', 'x'], roi.to_slices()):
+            if s.start is not None:
+                conditions.append('nodes.center_%s >= ?'%dim)
+                rtree_conditions.append('nodes_rtree.max_%s >= ?'%dim)
+                arguments.append(s.start)
+            if s.stop is not None:
+                conditions.append('nodes.center_%s < ?'%dim)
+                rtree_conditions.append('nodes_rtree.min_%s < ?'%dim)
+                arguments.append(s.stop)
+
+        if len(conditions) == 0:
+            return 'SELECT %s FROM nodes'%columns, arguments
+
+        if not self.__has_spatial_index(cursor):
+            return (
+                'SELECT %s FROM nodes WHERE %s'%(
+                    columns,
+                    ' AND '.join(conditions)),
+                arguments)
+
+        # The R*Tree stores 32-bit floats, rounded outwards. Use it to find
+        # candidates, then test the exact centers.
+        return (
+            '''
+            SELECT %s FROM nodes_rtree
+            JOIN nodes ON nodes.id = nodes_rtree.id
+            WHERE %s
+            '''%(columns, ' AND '.join(rtree_conditions + conditions)),
+            arguments + arguments)
 
     def __getitem__(self, roi):
 
         assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
 
-        slice_conditions = [
-            self.__slice_condition('center_%s'%dim, s.start, s.stop)
-            for dim, s in zip(['z', 'y', 'x'], roi.to_slices())
-            if s.start is not None or s.stop is not None
-        ]
-        if len(slice_conditions) > 0:
-            contains_condition = 'WHERE ' + ' AND '.join(slice_conditions)
-        else:
-            contains_condition = ''
+        connection = self.__connect()
+        try:
 
-        connection = sqlite3.connect(self.filename)
-        c = connection.cursor()
+            c = connection.cursor()
+            self.__select_nodes_in_roi(c, roi)
+            graph = self.__read_selected_rag(c)
 
-        graph = SqliteSubRag(self.filename, self.read_only, self.sync_edge_attributes)
+        finally:
 
-        node_query = '''
-            SELECT * FROM nodes %s
-        '''%contains_condition
-        logger.debug(node_query)
-        rows = c.execute(node_query)
+            connection.close()
 
-        # convert rows into dictionary
-        rows = [
-            {
-                name: row[i]
-                for i, name in enumerate(self.node_attributes)
-            }
-            for row in rows
-        ]
+        return graph
 
-        logger.debug("found %d nodes", len(rows))
+    def num_nodes(self, roi):
 
-        # create a list of nodes and their attributes
-        node_list = [
-            (row['id'], self.__remove_keys(row, ['id']))
-            for row in rows
-        ]
-        logger.debug("read nodes: %s", node_list)
+        assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
 
-        graph.add_nodes_from(node_list)
+        connection = self.__connect()
+        try:
 
-        nodes_condition = 'WHERE u in (%s)'%', '.join(
-            '%d'%u for u in graph.nodes())
-        edge_query = '''
-            SELECT * FROM edges %s
-        '''%nodes_condition
-        logger.debug(edge_query)
-        rows = c.execute(edge_query)
+            c = connection.cursor()
+            node_query, arguments = self.__nodes_in_roi_query(
+                c,
+                roi,
+                'COUNT(*)')
+            c.execute(node_query, arguments)
+            num = c.fetchone()[0]
 
-        # convert rows into dictionary
-        rows = [
-            {
-                name: row[i]
-                for i, name in enumerate(self.edge_attributes)
-            }
-            for row in rows
-        ]
-        connection.close()
+        finally:
 
-        # create a list of edges and their attributes
-        edge_list = [
-            (row['u'], row['v'], self.__remove_keys(row, ['u', 'v']))
-            for row in rows
-        ]
-        logger.debug("read edges: %s", edge_list)
+            connection.close()
+
+        return num
+
+    def has_edges(self, roi):
+
+        assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+
+        connection = self.__connect()
+        try:
 
-        graph.add_edges_from(edge_list)
+            c = connection.cursor()
+            node_query, arguments = self.__nodes_in_roi_query(
+                c,
+                roi,
+                'nodes.id')
+            c.execute('''
+                SELECT
+                    EXISTS (SELECT 1 FROM edges WHERE u IN (%s)) OR
+                    EXISTS (SELECT 1 FROM edges WHERE v IN (%s))
+            '''%(node_query, node_query), arguments + arguments)
+            has_edges = c.fetchone()[0] == 1
+
+        finally:
+
+            connection.close()
+
+        return has_edges
+
+    def has_edges_of_nodes(self, ids):
+        '''Check whether any of the nodes with the given IDs has an edge.'''
+
+        connection = self.__connect()
+        try:
+
+            c = connection.cursor()
+            self.__create_selection(c)
+            c.executemany(
+                'INSERT OR IGNORE INTO selected_nodes VALUES (?)',
+                ((int(i),) for i in ids))
+            c.execute('''
+                SELECT
+                    EXISTS (
+                        SELECT 1 FROM selected_nodes
+                        JOIN edges ON edges.u = selected_nodes.id) OR
+                    EXISTS (
+                        SELECT 1 FROM selected_nodes
+                        JOIN edges ON edges.v = selected_nodes.id)
+            ''')
+            has_edges = c.fetchone()[0] == 1
+
+        finally:
+
+            connection.close()
+
+        return has_edges
+
+    def read_rag(self, ids):
+
+        connection = self.__connect()
+        try:
+
+            c = connection.cursor()
+            self.__create_selection(c)
+            c.executemany(
+                'INSERT OR IGNORE INTO selected_nodes VALUES (?)',
+                ((int(i),) for i in ids))
+            graph = self.__read_selected_rag(c)
+
+        finally:
+
+            connection.close()
 
         return graph
 
-    def __remove_keys(self, dictionary, keys):
+    def read_columnar_rag(self, roi):
 
-        for key in keys:
-            del dictionary[key]
-        return dictionary
+        assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
 
-    def __write_rag(self, rag):
-        '''Write a complete RAG. This replaces whatever was stored in the DB
-        before.'''
+        connection = self.__connect()
+        try:
+
+            c = connection.cursor()
+            self.__select_nodes_in_roi(c, roi)
+
+            c.execute('''
+                SELECT
+                    nodes.id,
+                    nodes.center_z, nodes.center_y, nodes.center_x
+                FROM selected_nodes JOIN nodes ON nodes.id = selected_nodes.id
+            ''')
+            nodes = self._rows_to_columns(c, self.node_columns)
+
+            c.execute(self.__selected_edges_query(
+                '''
+                    edges.u, edges.v, edges.merge_score,
+                    COALESCE(edges.agglomerated, 0)
+                '''))
+            edges = self._rows_to_columns(
+                c,
+                [
+                    ('u', np.uint64),
+                    ('v', np.uint64),
+                    ('merge_score', np.float32),
+                    ('agglomerated', np.uint8)
+                ])
+
+        finally:
+
+            connection.close()
+
+        logger.debug(
+            "read %d nodes and %d edges",
+            len(nodes), len(edges))
+
+        return ColumnarRag(
+            node_ids=nodes['id'],
+            node_centers=np.stack([
+                nodes['center_z'],
+                nodes['center_y'],
+                nodes['center_x']
+            ], axis=1),
+            edges_u=edges['u'],
+            edges_v=edges['v'],
+            merge_score=edges['merge_score'],
+            agglomerated=edges['agglomerated'])
+
+    def read_nodes_array(self, roi=None):
+
+        connection = self.__connect()
+        try:
+
+            c = connection.cursor()
+            columns = ', '.join(
+                'nodes.%s'%name
+                for name, _ in self.node_columns)
+
+            if roi is None:
+                query = 'SELECT %s FROM nodes WHERE center_z IS NOT NULL'%(
+                    columns)
+                arguments = []
+            else:
+                assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+                query, arguments = self.__nodes_in_roi_query(c, roi, columns)
+
+            c.execute(query, arguments)
+            nodes = self._rows_to_columns(c, self.node_columns)
+
+        finally:
+
+            connection.close()
+
+        logger.debug("read %d nodes", len(nodes['id']))
+
+        return nodes
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+
+        for attr in attrs:
+            assert attr in self.edge_attributes[2:], (
+                "unknown edge attribute %s"%attr)
+
+        edge_columns = self._edge_columns(attrs)
+        columns = ', '.join('edges.%s'%name for name, _ in edge_columns)
+
+        connection = self.__connect()
+        try:
+
+            c = connection.cursor()
+
+            if roi is None:
+                c.execute('SELECT %s FROM edges'%columns)
+            else:
+                assert roi.dims() == 3, "Sorry, SQLite backend does only 3D"
+                self.__select_nodes_in_roi(c, roi)
+                c.execute(self.__selected_edges_query(columns))
+
+            edges = self._rows_to_columns(c, edge_columns)
+
+        finally:
+
+            connection.close()
+
+        logger.debug("read %d edges", len(edges['u']))
+
+        return edges
+
+    def __create_selection(self, cursor):
+        '''Create an empty temporary table ``selected_nodes`` to hold the IDs
+        of the nodes to read.'''
+
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS selected_nodes (
+                id INTEGER PRIMARY KEY)
+        ''')
+        cursor.execute('DELETE FROM selected_nodes')
+
+    def __select_nodes_in_roi(self, cursor, roi):
+
+        self.__create_selection(cursor)
+
+        node_query, arguments = self.__nodes_in_roi_query(
+            cursor,
+            roi,
+            'nodes.id')
+        cursor.execute(
+            'INSERT OR IGNORE INTO selected_nodes %s'%node_query,
+            arguments)
+
+        logger.debug("selected %d nodes in %s", cursor.rowcount, roi)
+
+    def __selected_edges_query(self, columns):
+        '''Get an SQL query that selects ``columns`` of all edges incident to
+        the selected nodes.'''
+
+        return '''
+            SELECT %s FROM selected_nodes
+            JOIN edges ON edges.u = selected_nodes.id
+            UNION ALL
+            SELECT %s FROM selected_nodes
+            JOIN edges ON edges.v = selected_nodes.id
+            WHERE edges.u NOT IN (SELECT id FROM selected_nodes)
+        '''%(columns, columns)
+
+    def __read_selected_rag(self, cursor):
+        '''Read the selected nodes and all their incident edges into a
+        sub-RAG.'''
+
+        graph = SqliteSubRag(self)
+
+        node_attributes = self.node_attributes[1:]
+        cursor.execute('''
+            SELECT nodes.* FROM selected_nodes
+            JOIN nodes ON nodes.id = selected_nodes.id
+        ''')
+        for row in cursor:
+            graph.add_node(row[0], **dict(zip(node_attributes, row[1:])))
+
+        edge_attributes = self.edge_attributes[2:]
+        cursor.execute(self.__selected_edges_query('edges.*'))
+        for row in cursor:
+            graph.add_edge(
+                row[0], row[1],
+                **dict(zip(edge_attributes, row[2:])))
+
+        logger.debug(
+            "read %d nodes and %d edges",
+            graph.number_of_nodes(), graph.number_of_edges())
+
+        return graph
+
+    def insert_nodes(self, nodes, done=None):
+        '''Write nodes, given as ``(id, data)`` tuples, in a single
+        transaction. If ``done`` is given as ``(stage, block_id)``, the block
+        is marked as done in the same transaction.'''
 
         if self.read_only:
             raise RuntimeError("Trying to write to read-only DB")
 
-        connection = sqlite3.connect(self.filename)
-        c = connection.cursor()
-        c.execute('DELETE FROM edges')
+        connection = self.__connect()
+        try:
+            with connection:
+                self.__insert_nodes(connection, nodes)
+                if done is not None:
+                    self.__mark_block_done(connection, *done)
+        finally:
+            connection.close()
+
+    def insert_edges(self, edges, done=None):
+        '''Write edges, given as ``(u, v, data)`` tuples, in a single
+        transaction. If ``done`` is given as ``(stage, block_id)``, the block
+        is marked as done in the same transaction.'''
 
-        for u, v, data in rag.edges(data=True):
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
 
-            u, v = min(u, v), max(u, v)
+        connection = self.__connect()
+        try:
+            with connection:
+                self.__insert_edges(connection, edges)
+                if done is not None:
+                    self.__mark_block_done(connection, *done)
+        finally:
+            connection.close()
 
-            values = {
-                'u': u,
-                'v': v
-            }
-            values.update(data)
+    def mark_block_done(self, stage, block_id):
 
-            names = ', '.join(self.edge_attributes)
-            values = ', '.join([
-                str(values[key]) if values[key] is not None else 'null'
-                for key in self.edge_attributes
-            ])
-            query = 'INSERT INTO edges (%s) VALUES (%s)'%(names, values)
-            logger.debug(query)
-            c.execute(query)
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
 
-        connection.commit()
-        connection.close()
+        connection = self.__connect()
+        try:
+            with connection:
+                self.__mark_block_done(connection, stage, block_id)
+        finally:
+            connection.close()
+
+    def read_blocks_done(self, stage):
+
+        connection = self.__connect()
+        try:
+            c = connection.cursor()
+            c.execute(
+                'SELECT block_id FROM blocks_done WHERE stage = ?',
+                (stage,))
+            blocks_done = set(row[0] for row in c)
+        finally:
+            connection.close()
+
+        return blocks_done
+
+    def is_block_done(self, stage, block_id):
+
+        connection = self.__connect()
+        try:
+            c = connection.cursor()
+            c.execute(
+                '''
+                SELECT EXISTS (
+                    SELECT 1 FROM blocks_done
+                    WHERE stage = ? AND block_id = ?)
+                ''',
+                (stage, int(block_id)))
+            done = c.fetchone()[0] == 1
+        finally:
+            connection.close()
+
+        return done
+
+    def __mark_block_done(self, connection, stage, block_id):
+
+        connection.execute(
+            'INSERT OR IGNORE INTO blocks_done VALUES (?, ?)',
+            (stage, int(block_id)))
+
+    def __insert_nodes(self, connection, nodes):
+
+        rows = [
+            (int(node),) + tuple(
+                self.__to_sql(data.get(name))
+                for name in self.node_attributes[1:]
+            )
+            for node, data in nodes
+        ]
+        self.__insert_rows(connection, 'nodes', self.node_attributes, rows)
+
+    def __insert_edges(self, connection, edges):
+
+        rows = [
+            (int(min(u, v)), int(max(u, v))) + tuple(
+                self.__to_sql(data.get(name))
+                for name in self.edge_attributes[2:]
+            )
+            for u, v, data in edges
+        ]
+        self.__insert_rows(connection, 'edges', self.edge_attributes, rows)
+
+    def __insert_rows(self, connection, table, names, rows):
+
+        query = '%s INTO %s (%s) VALUES (%s)'%(
+            self.insert_statements[self.on_conflict],
+            table,
+            ', '.join(names),
+            ', '.join(['?']*len(names)))
+
+        connection.executemany(query, rows)
+        logger.debug("wrote %d rows to %s", len(rows), table)
+
+    def __to_sql(self, value):
+
+        # sqlite3 can't bind numpy scalars
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def __write_rag(self, rag):
+        '''Write a complete RAG. This replaces whatever was stored in the DB
+        before.'''
+
+        if self.read_only:
+            raise RuntimeError("Trying to write to read-only DB")
+
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM nodes')
+                connection.execute('DELETE FROM edges')
+                self.__insert_nodes(connection, rag.nodes(data=True))
+                self.__insert_edges(connection, rag.edges(data=True))
+        finally:
+            connection.close()
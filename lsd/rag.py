@@ -1,8 +1,9 @@
 from __future__ import absolute_import
+from .rag_extraction import find_edges, find_node_statistics
 from funlib.segment.arrays import replace_values
 from networkx import Graph, connected_components
-from scipy.ndimage.measurements import center_of_mass
 import copy
+import numbers
 import numpy as np
 import skimage.future
 
@@ -26,6 +27,16 @@ class Rag(skimage.future.graph.RAG):
             `class:SharedRagProvider<SharedRagProviders>` to query and write
             edges within a certain region of interest.
 
+        contact_area (int):
+
+            The number of adjacent voxel pairs between the two fragments of an
+            edge. Only present for RAGs extracted from ``fragments``.
+
+        contact_center_{z,y,x} (float):
+
+            The centroid of the contact surface between the two fragments of
+            an edge. Only present for RAGs extracted from ``fragments``.
+
     Node attributes:
 
         labels (list of nodes):
@@ -34,6 +45,22 @@ class Rag(skimage.future.graph.RAG):
             Agglomeration algorithms are expected to update this list as they
             modify the RAG (as scikit's ``merge_hierarchical`` does).
 
+        size (int):
+
+            The number of voxels of a fragment. Only present for RAGs
+            extracted from ``fragments``.
+
+        center_{z,y,x} (float):
+
+            The center of mass of a fragment, in voxels. Only present for RAGs
+            extracted from ``fragments``.
+
+        bbox (``tuple`` of ``slice``):
+
+            The bounding box of a fragment, as returned by
+            ``scipy.ndimage.find_objects``. Only present for RAGs extracted
+            from ``fragments``.
+
     Args:
 
         fragments (``ndarray``, optional):
@@ -49,13 +76,116 @@ class Rag(skimage.future.graph.RAG):
 
     def __init__(self, fragments=None, connectivity=2):
 
-        super(Rag, self).__init__(fragments, connectivity)
+        super(Rag, self).__init__()
 
         if fragments is not None:
-            self.__find_edge_centers(fragments)
+            self.__extract_rag(fragments, connectivity)
             self.__add_esential_edge_attributes()
             self.__add_esential_node_attributes()
 
+    def to_arrays(self):
+        '''Convert this RAG into a dictionary of flat numpy arrays, e.g., to
+        send it to another process or to store it on disk. Use
+        :func:`from_arrays` to convert it back.
+
+        Each numeric node and edge attribute is stored in its own column
+        (``node_attr_<name>`` and ``edge_attr_<name>``). Columns are
+        ``int64`` if all values of the attribute are integers, and
+        ``float64`` otherwise, with ``NaN`` for missing or ``None`` values.
+        Integer columns with missing values come with a boolean mask
+        (``node_has_<name>`` and ``edge_has_<name>``), such that integer
+        attributes stay integers in :func:`from_arrays`. The ``labels`` of
+        nodes are stored as one concatenated array with offsets. All other
+        attributes are dropped.
+        '''
+
+        nodes = list(self.nodes(data=True))
+        edges = list(self.edges(data=True))
+
+        labels = [ data.get('labels', [node]) for node, data in nodes ]
+
+        arrays = {
+            'node_ids': np.array(
+                [ node for node, _ in nodes ],
+                dtype=np.uint64),
+            'node_labels': np.array(
+                [ label for node_labels in labels for label in node_labels ],
+                dtype=np.uint64),
+            'node_labels_offsets': np.cumsum(
+                [0] + [ len(node_labels) for node_labels in labels ],
+                dtype=np.int64),
+            'edges_u': np.array([ u for u, _, _ in edges ], dtype=np.uint64),
+            'edges_v': np.array([ v for _, v, _ in edges ], dtype=np.uint64)
+        }
+        arrays.update(self.__attributes_to_arrays(
+            'node_',
+            [ data for _, data in nodes ]))
+        arrays.update(self.__attributes_to_arrays(
+            'edge_',
+            [ data for _, _, data in edges ]))
+
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays, rag=None):
+        '''Create a RAG from a dictionary of arrays, as returned by
+        :func:`to_arrays`.
+
+        Args:
+
+            arrays (``dict`` from ``string`` to ``ndarray``):
+
+                The arrays to convert.
+
+            rag (`class:Rag`, optional):
+
+                If given, nodes and edges are added to this RAG instead of a
+                new one.
+        '''
+
+        if rag is None:
+            rag = Rag()
+
+        node_ids = arrays['node_ids'].tolist()
+        labels = arrays['node_labels'].tolist()
+        offsets = arrays['node_labels_offsets'].tolist()
+
+        node_data = [
+            { 'labels': labels[begin:end] }
+            for begin, end in zip(offsets[:-1], offsets[1:])
+        ]
+        edge_data = [ {} for _ in range(len(arrays['edges_u'])) ]
+
+        for key, column in arrays.items():
+            if key.startswith('node_attr_'):
+                Rag.__array_to_attributes(
+                    key[10:],
+                    column,
+                    arrays.get('node_has_' + key[10:]),
+                    node_data)
+            elif key.startswith('edge_attr_'):
+                Rag.__array_to_attributes(
+                    key[10:],
+                    column,
+                    arrays.get('edge_has_' + key[10:]),
+                    edge_data)
+
+        rag.add_nodes_from(zip(node_ids, node_data))
+        rag.add_edges_from(zip(
+            arrays['edges_u'].tolist(),
+            arrays['edges_v'].tolist(),
+            edge_data))
+
+        # add_{nodes,edges}_from bypass the max_id bookkeeping of
+        # skimage.future.graph.RAG
+        if len(node_ids) > 0:
+            rag.max_id = max(rag.max_id, max(node_ids))
+
+        rag.__add_esential_edge_attributes()
+        rag.__add_esential_node_attributes()
+
+        return rag
+
     def set_edge_attributes(self, key, value):
         '''Set all the attribute of all edges to the given value.'''
 
@@ -131,30 +261,124 @@ class Rag(skimage.future.graph.RAG):
         # relabel fragments of the same connected components to match merged RAG
         self.__relabel(fragments, components, segments)
 
-    def __find_edge_centers(self, fragments):
-        '''Get the center of an edge as the mean of the fragment centroids.'''
-
-        print(self.nodes())
-        fragment_centers = {
-            fragment: center
-            for fragment, center in zip(
-                self.nodes(),
-                center_of_mass(fragments, fragments, self.nodes()))
-        }
-
-        for u, v, data in self.edges(data=True):
-
-            center_u = fragment_centers[u]
-            center_v = fragment_centers[v]
-
-            center_edge = tuple(
-                (cu + cv)/2
-                for cu, cv in zip(center_u, center_v)
+    def __extract_rag(self, fragments, connectivity):
+        '''Add all labels of ``fragments`` as nodes and all pairs of adjacent
+        labels as edges.
+
+        Nodes get their size, center, and bounding box as attributes. The
+        center of an edge is the mean of its fragment centers.'''
+
+        labels, sizes, centers, bbox_begin, bbox_end = find_node_statistics(
+            fragments)
+        u, v, contact_area, contact_centers = find_edges(
+            fragments,
+            connectivity)
+
+        dims = ['z', 'y', 'x'][-fragments.ndim:]
+
+        self.add_nodes_from(
+            (
+                node,
+                dict(
+                    [
+                        ('size', size),
+                        ('bbox', tuple(
+                            slice(b, e)
+                            for b, e in zip(begin, end)))
+                    ] +
+                    [
+                        ('center_%s'%dim, c)
+                        for dim, c in zip(dims, center)
+                    ])
             )
-
-            data['center_z'] = center_edge[0]
-            data['center_y'] = center_edge[1]
-            data['center_x'] = center_edge[2]
+            for node, size, center, begin, end in zip(
+                labels.tolist(),
+                sizes.tolist(),
+                centers.tolist(),
+                bbox_begin.tolist(),
+                bbox_end.tolist())
+        )
+
+        edge_centers = 0.5*(
+            centers[np.searchsorted(labels, u)] +
+            centers[np.searchsorted(labels, v)])
+
+        self.add_edges_from(
+            (
+                e_u, e_v,
+                dict(
+                    [('contact_area', area)] +
+                    [
+                        ('center_%s'%dim, c)
+                        for dim, c in zip(dims, center)
+                    ] +
+                    [
+                        ('contact_center_%s'%dim, c)
+                        for dim, c in zip(dims, contact_center)
+                    ])
+            )
+            for e_u, e_v, area, center, contact_center in zip(
+                u.tolist(),
+                v.tolist(),
+                contact_area.tolist(),
+                edge_centers.tolist(),
+                contact_centers.tolist())
+        )
+
+        # add_{nodes,edges}_from bypass the max_id bookkeeping of
+        # skimage.future.graph.RAG
+        if len(labels) > 0:
+            self.max_id = max(self.max_id, int(labels[-1]))
+
+    def __attributes_to_arrays(self, prefix, attributes):
+
+        keys = set(
+            key
+            for data in attributes
+            for key, value in data.items()
+            if isinstance(value, numbers.Number)
+        )
+
+        arrays = {}
+        for key in keys:
+
+            values = [ data.get(key) for data in attributes ]
+            present = [ value is not None for value in values ]
+
+            if all(
+                    isinstance(value, numbers.Integral)
+                    for value, has in zip(values, present) if has):
+                arrays[prefix + 'attr_' + key] = np.array(
+                    [
+                        value if has else 0
+                        for value, has in zip(values, present)
+                    ],
+                    dtype=np.int64)
+                if not all(present):
+                    arrays[prefix + 'has_' + key] = np.array(
+                        present,
+                        dtype=np.bool_)
+            elif all(
+                    value is None or isinstance(value, numbers.Number)
+                    for value in values):
+                arrays[prefix + 'attr_' + key] = np.array(
+                    [ np.nan if value is None else value for value in values ],
+                    dtype=np.float64)
+
+        return arrays
+
+    @staticmethod
+    def __array_to_attributes(key, column, mask, attributes):
+
+        if mask is None:
+            mask = np.ones(len(column), dtype=np.bool_)
+        if column.dtype.kind == 'f':
+            mask = np.logical_and(mask, ~np.isnan(column))
+
+        values = column.tolist()
+        for data, value, has in zip(attributes, values, mask.tolist()):
+            if has:
+                data[key] = value
 
     def __add_esential_edge_attributes(self):
 
@@ -163,7 +387,7 @@ class Rag(skimage.future.graph.RAG):
             if 'merge_score' not in data:
                 data['merge_score'] = None
 
-            if 'agglomeration' not in data:
+            if 'agglomerated' not in data:
                 data['agglomerated'] = 0
 
     def __add_esential_node_attributes(self):
@@ -177,38 +401,77 @@ class Rag(skimage.future.graph.RAG):
         '''Contract all nodes of one component into a single node, return the
         single node for each component.
 
-        This will create new edges that will have only ``merge_score`` and
-        ``agglomerated`` attributes, set to 0.
+        All components are contracted at once: the edge list is relabelled
+        with a lookup table from nodes to component nodes, and only the
+        remaining unique edges between components are kept. As for
+        ``merge_nodes``, all edges of nodes that represent more than one node
+        get ``merge_score`` set to ``None`` and ``agglomerated`` set to 0. New
+        edges have only these two attributes.
         '''
 
         self.__add_esential_node_attributes()
 
-        component_nodes = []
+        component_nodes = [ component[-1] for component in components ]
+        nodes, representatives = self.__get_component_lut(
+            components,
+            component_nodes)
+
+        # relabel all edges with the node representing their components, drop
+        # edges within components and duplicates
+        edges = np.array(list(self.edges()), dtype=nodes.dtype).reshape(-1, 2)
+        edges = representatives[np.searchsorted(nodes, edges)]
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+
+        for component, component_node in zip(components, component_nodes):
+            if len(component) > 1:
+                self.node[component_node]['labels'] = [
+                    label
+                    for node in component
+                    for label in self.node[node]['labels']
+                ]
+
+        # this also removes all edges of contracted nodes, the remaining edges
+        # are between component nodes
+        self.remove_nodes_from(
+            nodes[nodes != representatives].tolist())
+
+        # edges between two single-node components are the only ones not
+        # touched, the others are added or have their attributes updated
+        contracted = set(
+            component_node
+            for component, component_node in zip(components, component_nodes)
+            if len(component) > 1)
+        self.add_edges_from(
+            (u, v, {'merge_score': None, 'agglomerated': 0})
+            for u, v in edges.tolist()
+            if u in contracted or v in contracted)
 
-        for component in components:
+        return component_nodes
 
-            for i in range(1, len(component)):
-                self.merge_nodes(
-                    component[i - 1],
-                    component[i],
-                    # set default attributes for new edges
-                    weight_func=lambda _, _src, _dst, _n: {
-                        'merge_score': None,
-                        'agglomerated': 0
-                    })
+    def __get_component_lut(self, components, component_labels):
+        '''Get a lookup table from each node in ``components`` to the label of
+        its component, as two arrays sorted by node.'''
 
-            component_nodes.append(component[-1])
+        sizes = [ len(component) for component in components ]
 
-        return component_nodes
+        nodes = np.fromiter(
+            (node for component in components for node in component),
+            dtype=np.uint64,
+            count=sum(sizes))
+        labels = np.repeat(np.array(component_labels, dtype=np.uint64), sizes)
 
-    def __relabel(self, array, components, component_labels):
+        order = np.argsort(nodes)
 
-        old_values = []
-        new_values = []
+        return nodes[order], labels[order]
+
+    def __relabel(self, array, components, component_labels):
 
-        for component, label in zip(components, component_labels):
-            for c in component:
-                old_values.append(c)
-                new_values.append(label)
+        old_values, new_values = self.__get_component_lut(
+            components,
+            component_labels)
 
-        array[:] = replace_values(array, old_values, new_values)
+        array[:] = replace_values(
+            array,
+            old_values.astype(array.dtype),
+            new_values.astype(array.dtype))
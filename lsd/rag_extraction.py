@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+from scipy.ndimage import generate_binary_structure
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def find_edges(fragments, connectivity=1):
+    '''Find all pairs of adjacent labels in a label image.
+
+    Instead of visiting each voxel, the label image is compared to shifted
+    copies of itself, one for each neighbor offset of the given connectivity.
+
+    Args:
+
+        fragments (``ndarray``):
+
+            The label image.
+
+        connectivity (int, optional):
+
+            The connectivity to consider, as in
+            ``scipy.ndimage.generate_binary_structure``.
+
+    Returns:
+
+        ``(u, v, contact_area, contact_centers)``, with ``u < v`` the labels
+        of each edge, ``contact_area`` the number of adjacent voxel pairs
+        between ``u`` and ``v``, and ``contact_centers`` (one row per edge)
+        the mean location of the midpoints between those voxel pairs, in
+        voxels.
+    '''
+
+    dims = fragments.ndim
+
+    # map labels to dense indices, such that edges can be encoded as a single
+    # integer key
+    labels, dense = np.unique(fragments, return_inverse=True)
+    dense = dense.reshape(fragments.shape)
+    num_labels = len(labels)
+
+    keys = []
+    midpoints = []
+
+    for offset in _get_neighbor_offsets(dims, connectivity):
+
+        slices_a = tuple(
+            slice(max(0, -o), s - max(0, o))
+            for o, s in zip(offset, fragments.shape))
+        slices_b = tuple(
+            slice(max(0, o), s - max(0, -o))
+            for o, s in zip(offset, fragments.shape))
+
+        a = dense[slices_a]
+        b = dense[slices_b]
+        boundary = a != b
+
+        if not boundary.any():
+            continue
+
+        a = a[boundary]
+        b = b[boundary]
+        keys.append(
+            np.minimum(a, b).astype(np.int64)*num_labels +
+            np.maximum(a, b))
+
+        # the midpoint between a voxel in a and its neighbor in b
+        midpoints.append(np.stack([
+            c + s.start + 0.5*o
+            for c, s, o in zip(np.nonzero(boundary), slices_a, offset)
+        ], axis=1))
+
+    if len(keys) == 0:
+        return (
+            np.zeros((0,), dtype=fragments.dtype),
+            np.zeros((0,), dtype=fragments.dtype),
+            np.zeros((0,), dtype=np.int64),
+            np.zeros((0, dims), dtype=np.float64))
+
+    keys, edges = np.unique(np.concatenate(keys), return_inverse=True)
+    midpoints = np.concatenate(midpoints)
+
+    contact_area = np.bincount(edges)
+    contact_centers = np.stack([
+        np.bincount(edges, weights=midpoints[:, d])/contact_area
+        for d in range(dims)
+    ], axis=1)
+
+    u = labels[keys//num_labels]
+    v = labels[keys%num_labels]
+
+    logger.debug("found %d edges between %d labels", len(keys), num_labels)
+
+    return u, v, contact_area, contact_centers
+
+def find_node_statistics(fragments):
+    '''Find the size, center of mass, and bounding box of each label in a
+    label image.
+
+    All statistics are computed in a single pass over the flattened label
+    image, using ``np.bincount`` for sizes and coordinate sums.
+
+    Args:
+
+        fragments (``ndarray``):
+
+            The label image.
+
+    Returns:
+
+        ``(labels, sizes, centers, bbox_begin, bbox_end)``, with ``labels``
+        the sorted unique labels, ``sizes`` their number of voxels, and
+        ``centers``, ``bbox_begin``, and ``bbox_end`` (one row per label)
+        their center of mass and (exclusive) bounding box, in voxels.
+    '''
+
+    dims = fragments.ndim
+
+    labels, dense = np.unique(fragments, return_inverse=True)
+    dense = dense.ravel()
+    num_labels = len(labels)
+
+    sizes = np.bincount(dense, minlength=num_labels)
+
+    # sort voxels by label, such that min and max coordinates of each label
+    # can be found with reduceat
+    order = np.argsort(dense, kind='stable')
+    starts = np.cumsum(sizes) - sizes
+
+    centers = np.zeros((num_labels, dims), dtype=np.float64)
+    bbox_begin = np.zeros((num_labels, dims), dtype=np.int64)
+    bbox_end = np.zeros((num_labels, dims), dtype=np.int64)
+
+    if num_labels == 0:
+        return labels, sizes, centers, bbox_begin, bbox_end
+
+    indices = np.arange(fragments.size)
+    stride = fragments.size
+    for d in range(dims):
+
+        # coordinate of each voxel along axis d
+        stride //= fragments.shape[d]
+        coordinates = (indices//stride)%fragments.shape[d]
+
+        centers[:, d] = np.bincount(
+            dense,
+            weights=coordinates,
+            minlength=num_labels)/sizes
+
+        coordinates = coordinates[order]
+        bbox_begin[:, d] = np.minimum.reduceat(coordinates, starts)
+        bbox_end[:, d] = np.maximum.reduceat(coordinates, starts) + 1
+
+    return labels, sizes, centers, bbox_begin, bbox_end
+
+def _get_neighbor_offsets(dims, connectivity):
+    '''Get all neighbor offsets of the given connectivity that point "forward"
+    (the first non-zero component is positive), such that each pair of
+    neighbors is considered exactly once.'''
+
+    structure = generate_binary_structure(dims, connectivity)
+    offsets = np.transpose(np.nonzero(structure)) - 1
+
+    return [
+        tuple(offset)
+        for offset in offsets
+        if any(offset) and offset[np.nonzero(offset)[0][0]] > 0
+    ]
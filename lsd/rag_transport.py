@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+from .rag import Rag
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def save_rag(rag, filename):
+    '''Store a RAG in an ``.npz`` file, using the arrays returned by
+    :func:`Rag.to_arrays`.'''
+
+    np.savez(filename, **rag.to_arrays())
+
+def load_rag(filename, rag=None):
+    '''Load a RAG stored with :func:`save_rag`.
+
+    Args:
+
+        filename (``string``):
+
+            The ``.npz`` file to read from.
+
+        rag (`class:Rag`, optional):
+
+            If given, nodes and edges are added to this RAG instead of a new
+            one.
+    '''
+
+    with np.load(filename) as arrays:
+        return Rag.from_arrays(dict(arrays), rag)
+
+def share_rag(rag):
+    '''Copy a RAG into a block of shared memory, to pass it to another process
+    without pickling.
+
+    Returns:
+
+        ``(shm, handle)``, with ``shm`` the
+        ``multiprocessing.shared_memory.SharedMemory`` holding the RAG and
+        ``handle`` a small, picklable description of its content to be passed
+        to :func:`attach_rag`. The caller is responsible for calling
+        ``shm.close()`` and ``shm.unlink()`` once all receivers attached.
+    '''
+
+    # imported here, shared memory needs Python 3.8
+    from multiprocessing import shared_memory
+
+    arrays = rag.to_arrays()
+
+    # place each array at an 8-byte aligned offset
+    layout = []
+    offset = 0
+    for key, array in arrays.items():
+        layout.append((key, array.dtype.str, array.shape, offset))
+        offset += (array.nbytes + 7)//8*8
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+
+    for key, dtype, shape, offset in layout:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[:] = \
+            arrays[key]
+
+    logger.debug("shared RAG in %s (%d bytes)", shm.name, shm.size)
+
+    return shm, (shm.name, layout)
+
+def attach_rag(handle, rag=None):
+    '''Read a RAG shared with :func:`share_rag`.
+
+    Args:
+
+        handle (``tuple``):
+
+            The handle returned by :func:`share_rag`.
+
+        rag (`class:Rag`, optional):
+
+            If given, nodes and edges are added to this RAG instead of a new
+            one.
+    '''
+
+    from multiprocessing import shared_memory
+
+    name, layout = handle
+
+    shm = shared_memory.SharedMemory(name=name)
+
+    try:
+
+        arrays = {
+            key: np.ndarray(
+                shape,
+                dtype=dtype,
+                buffer=shm.buf,
+                offset=offset).copy()
+            for key, dtype, shape, offset in layout
+        }
+
+    finally:
+
+        shm.close()
+
+    return Rag.from_arrays(arrays, rag)
@@ -1,5 +1,8 @@
 from __future__ import absolute_import
+from .columnar_rag import ColumnarRag
 from .rag import Rag
+import itertools
+import numpy as np
 
 class SharedRagProvider(object):
     '''Interface for shared region adjacency graph providers that supports
@@ -19,24 +22,171 @@ class SharedRagProvider(object):
 
         # write edges
         sub_rag.sync_edges()
+
+    Implementations can also keep a registry of processed blocks, such that
+    finished blocks can be skipped without querying the RAG. Marks are given
+    as ``done=(stage, block_id)`` to the ``sync_*`` or ``write_*`` methods of
+    the sub-RAG, to be stored together with the nodes or edges of the block.
     '''
 
+    # columns returned by read_nodes_array
+    node_columns = [
+        ('id', np.uint64),
+        ('center_z', np.float32),
+        ('center_y', np.float32),
+        ('center_x', np.float32)
+    ]
+
     def __getitem__(self, roi):
         raise RuntimeError("not implemented in %s"%self.name())
 
+    def num_nodes(self, roi):
+        '''Get the number of nodes in ``roi``.'''
+        raise RuntimeError("not implemented in %s"%self.name())
+
+    def has_edges(self, roi):
+        '''Check whether any node in ``roi`` has an edge.'''
+        raise RuntimeError("not implemented in %s"%self.name())
+
+    def read_rag(self, ids):
+        '''Get the sub-RAG of the nodes with the given IDs and all their
+        edges.'''
+        raise RuntimeError("not implemented in %s"%self.name())
+
+    def mark_block_done(self, stage, block_id):
+        '''Record that processing stage ``stage`` finished for the block with
+        ID ``block_id``.'''
+        raise RuntimeError("not implemented in %s"%self.name())
+
+    def read_blocks_done(self, stage):
+        '''Get the set of IDs of all blocks for which ``stage`` finished.'''
+        raise RuntimeError("not implemented in %s"%self.name())
+
+    def is_block_done(self, stage, block_id):
+        '''Check whether ``stage`` finished for the block with ID
+        ``block_id``. To check many blocks, use :func:`read_blocks_done`.'''
+
+        return block_id in self.read_blocks_done(stage)
+
+    def flush(self):
+        '''Write pending writes, if this provider buffers them. Workers call
+        this after their last block, and after blocks processed one at a
+        time.'''
+        pass
+
+    def read_columnar_rag(self, roi):
+        '''Read the sub-RAG in ``roi`` as a `class:ColumnarRag`.
+
+        This default implementation converts ``self[roi]``. Implementations
+        should overwrite it to fill the columns directly.'''
+
+        return ColumnarRag.from_rag(self[roi])
+
+    def read_nodes_array(self, roi=None):
+        '''Read the nodes in ``roi`` (or all nodes, if ``roi`` is ``None``)
+        as a dictionary of contiguous arrays ``id`` (``uint64``) and
+        ``center_z``, ``center_y``, ``center_x`` (``float32``).
+
+        This default implementation converts ``self[roi]`` and needs a
+        ``roi``. Implementations should overwrite it to stream the columns
+        directly.'''
+
+        if roi is None:
+            raise RuntimeError(
+                "reading all nodes not implemented in %s"%self.name())
+
+        return self._rows_to_columns(
+            (
+                (node, data['center_z'], data['center_y'], data['center_x'])
+                for node, data in self[roi].nodes(data=True)
+                if 'center_z' in data
+            ),
+            self.node_columns)
+
+    def read_edges_array(self, roi=None, attrs=('merge_score',)):
+        '''Read the edges incident to nodes in ``roi`` (or all edges, if
+        ``roi`` is ``None``) as a dictionary of contiguous arrays ``u`` and
+        ``v`` (``uint64``), and one ``float64`` array for each edge attribute
+        in ``attrs``. Attributes that are ``None`` or not set are ``NaN``.
+
+        This default implementation converts ``self[roi]`` and needs a
+        ``roi``. Implementations should overwrite it to stream the columns
+        directly.'''
+
+        if roi is None:
+            raise RuntimeError(
+                "reading all edges not implemented in %s"%self.name())
+
+        return self._rows_to_columns(
+            (
+                (u, v) + tuple(data.get(attr) for attr in attrs)
+                for u, v, data in self[roi].edges(data=True)
+            ),
+            self._edge_columns(attrs))
+
+    def _edge_columns(self, attrs):
+        '''Get the columns returned by :func:`read_edges_array`.'''
+
+        return [
+            ('u', np.uint64),
+            ('v', np.uint64)
+        ] + [
+            (attr, np.float64)
+            for attr in attrs
+        ]
+
+    def _rows_to_columns(self, rows, columns, chunk_size=100000):
+        '''Convert an iterable of row tuples into a dictionary of contiguous
+        arrays, one for each ``(name, dtype)`` in ``columns``. Rows are
+        consumed in chunks of ``chunk_size``, such that cursors can be
+        streamed without holding all rows as Python objects.'''
+
+        rows = iter(rows)
+        chunks = [np.zeros((0,), dtype=columns)]
+
+        while True:
+
+            chunk = list(itertools.islice(rows, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            chunks.append(np.array(chunk, dtype=columns))
+
+        return self._split_columns(np.concatenate(chunks), columns)
+
+    def _split_columns(self, array, columns):
+        '''Split a structured array into a dictionary of contiguous arrays,
+        one for each ``(name, dtype)`` in ``columns``.'''
+
+        return {
+            name: np.ascontiguousarray(array[name], dtype=dtype)
+            for name, dtype in columns
+        }
+
     def name(self):
         return type(self).__name__
 
 class SubRag(Rag):
 
-    def sync_edges(self, roi):
+    def sync_edges(self, roi, done=None):
         '''Write edges and their attributes. Restrict the sync to the given
-        ROI.'''
+        ROI. If ``done`` is given as ``(stage, block_id)``, mark this block as
+        done together with the write.'''
         raise RuntimeError("not implemented in %s"%self.name())
 
-    def sync_nodes(self):
-        '''Write nodes and their attributes.'''
+    def sync_nodes(self, done=None):
+        '''Write nodes and their attributes. If ``done`` is given as
+        ``(stage, block_id)``, mark this block as done together with the
+        write.'''
         raise RuntimeError("not implemented in %s"%self.name())
 
+    def write_edges(self, roi, done=None):
+        '''Same as :func:`sync_edges`.'''
+        self.sync_edges(roi, done=done)
+
+    def write_nodes(self, roi=None, done=None):
+        '''Same as :func:`sync_nodes`, ``roi`` is ignored.'''
+        self.sync_nodes(done=done)
+
     def name(self):
         return type(self).__name__
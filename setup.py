@@ -22,7 +22,13 @@ setup(
                     'lsd/merge_tree.pyx'
                 ],
                 extra_compile_args=['-O3'],
-                language='c++')
+                language='c++'),
+            Extension(
+                'lsd.merge_forest',
+                sources=[
+                    'lsd/merge_forest.pyx'
+                ],
+                extra_compile_args=['-O3'])
         ],
         cmdclass={'build_ext': build_ext}
 )
@@ -0,0 +1,95 @@
+from lsd.persistence import BufferedRagProvider, SqliteRagProvider
+import daisy
+import logging
+import multiprocessing
+import os
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger(
+    'lsd.persistence.buffered_rag_provider').setLevel(logging.DEBUG)
+
+roi = daisy.Roi((0, 0, 0), (10, 10, 10))
+
+class FailingRagProvider(SqliteRagProvider):
+    '''Fails to write edges as long as ``fail`` is set.'''
+
+    fail = True
+
+    def insert_edges(self, edges, done=None):
+
+        if self.fail:
+            raise IOError("edges can not be written")
+
+        super(FailingRagProvider, self).insert_edges(edges, done=done)
+
+def worker(rag_provider, block_id):
+
+    sub_rag = rag_provider[roi]
+    sub_rag.add_node(
+        block_id + 1,
+        center_z=block_id + 1,
+        center_y=1,
+        center_x=1)
+    sub_rag.sync_nodes(done=('nodes', block_id))
+
+    rag_provider.flush()
+
+    # daisy workers exit without running atexit handlers
+    os._exit(0)
+
+if __name__ == "__main__":
+
+    provider = SqliteRagProvider('test_buffered_rag_provider.db', 'w')
+    rag_provider = BufferedRagProvider(provider, max_rows=1000, max_delay=60)
+
+    # writes in worker processes are flushed before the workers exit
+    workers = [
+        multiprocessing.Process(target=worker, args=(rag_provider, block_id))
+        for block_id in range(3)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    assert provider.num_nodes(roi) == 3
+    assert provider.read_blocks_done('nodes') == set([0, 1, 2])
+
+    # writes are buffered until closed
+    with BufferedRagProvider(provider, max_rows=1000, max_delay=60) as buffered:
+
+        sub_rag = buffered[roi]
+        sub_rag.add_node(4, center_z=4, center_y=1, center_x=1)
+        sub_rag.sync_nodes(done=('nodes', 3))
+
+        assert provider.num_nodes(roi) == 3
+        assert not provider.is_block_done('nodes', 3)
+
+    assert provider.num_nodes(roi) == 4
+    assert provider.is_block_done('nodes', 3)
+
+    # failed writes stay in the buffer, blocks are not marked done before
+    provider = FailingRagProvider('test_buffered_rag_provider.db', 'w')
+    rag_provider = BufferedRagProvider(provider, max_rows=1000, max_delay=60)
+
+    sub_rag = rag_provider[roi]
+    sub_rag.add_node(1, center_z=1, center_y=1, center_x=1)
+    sub_rag.add_node(2, center_z=2, center_y=1, center_x=1)
+    sub_rag.add_edge(1, 2, merge_score=0.5, agglomerated=0)
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(roi, done=('edges', 0))
+
+    try:
+        rag_provider.flush()
+        assert False, "failed write was not raised"
+    except IOError:
+        pass
+
+    assert provider.num_nodes(roi) == 2
+    assert not provider.is_block_done('edges', 0)
+
+    provider.fail = False
+    rag_provider.close()
+
+    assert provider[roi].number_of_edges() == 1
+    assert provider.is_block_done('edges', 0)
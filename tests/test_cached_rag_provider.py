@@ -0,0 +1,65 @@
+from lsd.persistence import (
+    CachedRagProvider,
+    FileRagProvider,
+    ShardedSqliteRagProvider,
+    SqliteRagProvider)
+import daisy
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger(
+    'lsd.persistence.cached_rag_provider').setLevel(logging.DEBUG)
+
+def test_cached(provider):
+
+    total_roi = daisy.Roi((0, 0, 0), (20, 20, 20))
+
+    sub_rag = provider[total_roi]
+    for node in range(1, 5):
+        sub_rag.add_node(
+            node,
+            center_z=node*4,
+            center_y=5,
+            center_x=5)
+    for node in range(1, 4):
+        sub_rag.add_edge(node, node + 1, merge_score=0.1, agglomerated=0)
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    rag_provider = CachedRagProvider(provider)
+    assert not rag_provider.read_only
+
+    # reading the same ROI twice, and an ROI inside of it, hits the cache
+    rag_provider[total_roi]
+    sub_rag = rag_provider[daisy.Roi((0, 0, 0), (20, 20, 20))]
+    assert len(rag_provider.cache) == 1
+    assert sub_rag.number_of_nodes() == 4
+    assert sub_rag.number_of_edges() == 3
+
+    roi = daisy.Roi((0, 0, 0), (10, 20, 20))
+    sub_rag = rag_provider[roi]
+    assert len(rag_provider.cache) == 1
+    assert sorted(sub_rag.nodes()) == [1, 2, 3]
+    assert sub_rag.node[2]['center_z'] == 8
+    assert sub_rag.node[3] == {}
+    assert rag_provider.num_nodes(roi) == 2
+    assert rag_provider.has_edges(roi)
+
+    # writes through the cache invalidate cached sub-RAGs
+    sub_rag.edges[1, 2]['merge_score'] = 0.5
+    sub_rag.sync_edges(roi)
+    assert len(rag_provider.cache) == 0
+
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.edges[1, 2]['merge_score'] == 0.5
+    assert len(rag_provider.cache) == 1
+
+if __name__ == "__main__":
+
+    test_cached(SqliteRagProvider('test_cached_rag_provider.db', 'w'))
+    test_cached(
+        ShardedSqliteRagProvider(
+            'test_cached_sharded_rag_provider',
+            'w',
+            shard_size=(10, 10, 10)))
+    test_cached(FileRagProvider('test_cached_file_rag_provider', 'w'))
@@ -0,0 +1,105 @@
+from lsd.persistence import FileRagProvider
+import daisy
+import logging
+import multiprocessing
+import numpy as np
+import os
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger(
+    'lsd.persistence.file_rag_provider').setLevel(logging.DEBUG)
+
+def write_block(block_id):
+
+    # each writer adds a chain of 100 nodes in its own slab along z
+    rag_provider = FileRagProvider('test_file_rag_provider', 'r+')
+    roi = daisy.Roi((block_id*10, 0, 0), (10, 20, 20))
+
+    sub_rag = rag_provider[roi]
+    offset = block_id*100
+    for node in range(offset + 1, offset + 101):
+        sub_rag.add_node(
+            node,
+            center_z=block_id*10 + 5,
+            center_y=5,
+            center_x=5)
+    for node in range(offset + 1, offset + 100):
+        sub_rag.add_edge(node, node + 1, merge_score=0.1, agglomerated=1)
+
+    sub_rag.sync_nodes(done=('nodes', block_id))
+    sub_rag.sync_edges(roi, done=('edges', block_id))
+
+if __name__ == "__main__":
+
+    rag_provider = FileRagProvider('test_file_rag_provider', 'w')
+
+    total_roi = daisy.Roi((0, 0, 0), (40, 20, 20))
+
+    # writers do not wait for each other
+    writers = [
+        multiprocessing.Process(target=write_block, args=(block_id,))
+        for block_id in range(4)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    assert rag_provider.read_blocks_done('nodes') == set(range(4))
+    assert rag_provider.read_blocks_done('edges') == set(range(4))
+
+    # one manifest per write, and no temporary files left
+    filenames = os.listdir('test_file_rag_provider')
+    assert len([f for f in filenames if f.endswith('.json')]) == 8
+    assert not any(f.endswith('.tmp') for f in filenames)
+
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.number_of_nodes() == 400
+    assert sub_rag.number_of_edges() == 396
+
+    # edges written again replace earlier writes, in the order of writes
+    roi = daisy.Roi((0, 0, 0), (10, 20, 20))
+    sub_rag = rag_provider[roi]
+    sub_rag.edges[1, 2]['merge_score'] = 0.5
+    sub_rag.sync_edges(roi)
+    sub_rag.edges[1, 2]['merge_score'] = 0.7
+    sub_rag.edges[1, 2]['agglomerated'] = 0
+    sub_rag.sync_edges(roi)
+
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.number_of_edges() == 396
+    assert sub_rag.edges[1, 2]['merge_score'] == 0.7
+    assert sub_rag.edges[1, 2]['agglomerated'] == 0
+    assert sub_rag.edges[2, 3]['merge_score'] == 0.1
+
+    edges = rag_provider.read_edges_array(attrs=['merge_score'])
+    assert len(edges['u']) == 396
+    assert edges['merge_score'][(edges['u'] == 1) & (edges['v'] == 2)] == 0.7
+
+    # partial writes are not visible to readers
+    open(
+        os.path.join('test_file_rag_provider', '0_0_0.edges.json.tmp'),
+        'w').close()
+    assert rag_provider[total_roi].number_of_edges() == 396
+
+    # nodes without center are rejected
+    try:
+        rag_provider.insert_nodes([(1000, {})])
+        assert False, "node without center was accepted"
+    except RuntimeError:
+        pass
+    assert rag_provider.num_nodes(total_roi) == 400
+
+    # reads of an ROI find the nodes and edges of its block only
+    roi = daisy.Roi((10, 0, 0), (10, 20, 20))
+    sub_rag = rag_provider[roi]
+    assert rag_provider.num_nodes(roi) == 100
+    assert sub_rag.degree(101) == 1
+    assert sub_rag.degree(150) == 2
+
+    print(
+        "%d nodes and %d edges in %s" % (
+            sub_rag.number_of_nodes(),
+            sub_rag.number_of_edges(),
+            roi))
@@ -0,0 +1,62 @@
+from lsd import find_segments
+from lsd.find_segments import load_lut, lut_filename
+from lsd.persistence import SqliteRagProvider
+import daisy
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('lsd.find_segments').setLevel(logging.DEBUG)
+
+if __name__ == "__main__":
+
+    np.random.seed(42)
+
+    rag_provider = SqliteRagProvider('test_find_segments.db', 'w')
+
+    total_roi = daisy.Roi((0, 0, 0), (20, 20, 20))
+
+    # a chain of 100 fragments, with increasing scores
+    sub_rag = rag_provider[total_roi]
+    centers = np.random.uniform(0, 20, size=(100, 3))
+    for node, center in enumerate(centers):
+        sub_rag.add_node(
+            node + 1,
+            center_z=center[0],
+            center_y=center[1],
+            center_x=center[2])
+    for node in range(1, 100):
+        sub_rag.add_edge(
+            node, node + 1,
+            merge_score=(node%10)/10.0 if node != 50 else None,
+            agglomerated=0)
+
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    thresholds = [0.0, 0.45, 1.0]
+    find_segments(rag_provider, thresholds, 'test_find_segments')
+
+    for threshold in thresholds:
+
+        lut_file = lut_filename('test_find_segments', threshold)
+        lut = np.load(lut_file)['fragment_segment_lut']
+        assert list(lut[0]) == list(range(1, 101))
+
+        # the memory-mapped LUT is the same
+        fragments, segments = load_lut(lut_file)
+        assert (fragments == lut[0]).all()
+        assert (segments == lut[1]).all()
+
+        # compare against connected components of the networkx RAG
+        components = rag_provider[total_roi].get_connected_components(
+            threshold)
+        assert len(np.unique(lut[1])) == len(components)
+        for component in components:
+            segments = lut[1][np.isin(lut[0], list(component))]
+            assert len(np.unique(segments)) == 1
+
+        print(
+            "%d segments for threshold %g" % (
+                len(components),
+                threshold))
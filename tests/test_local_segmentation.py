@@ -0,0 +1,72 @@
+from lsd.local_segmentation import LocalSegmentationExtractor
+from lsd.persistence import MongoDbRagProvider
+import daisy
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('lsd.local_segmentation').setLevel(logging.DEBUG)
+
+if __name__ == "__main__":
+
+    # requires a MongoDB server on localhost
+
+    total_roi = daisy.Roi((0, 0, 0), (10, 10, 10))
+
+    # four fragments, one per quarter of the volume
+    fragments = daisy.prepare_ds(
+        'test_local_segmentation.zarr',
+        'fragments',
+        total_roi,
+        (1, 1, 1),
+        np.uint64)
+    data = np.zeros((10, 10, 10), dtype=np.uint64)
+    data[:5, :5] = 1
+    data[:5, 5:] = 2
+    data[5:, :5] = 3
+    data[5:, 5:] = 4
+    fragments[total_roi] = data
+
+    rag_provider = MongoDbRagProvider(
+        'test_local_segmentation',
+        host='localhost',
+        mode='w')
+    sub_rag = rag_provider[total_roi]
+    for node in range(1, 5):
+        sub_rag.add_node(node, center_z=0, center_y=0, center_x=0)
+    sub_rag.add_edge(1, 2, merge_score=0.1, agglomerated=1)
+    sub_rag.add_edge(2, 3, merge_score=0.5, agglomerated=1)
+    sub_rag.add_edge(3, 4, merge_score=0.9, agglomerated=1)
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    roi = daisy.Roi((0, 0, 0), (10, 10, 10))
+
+    for max_cached_rois in [0, 2]:
+
+        extractor = LocalSegmentationExtractor(
+            'localhost',
+            'test_local_segmentation',
+            'edges',
+            'test_local_segmentation.zarr',
+            'fragments',
+            max_cached_rois=max_cached_rois)
+
+        # the same ROI twice, the second time from the cache (if enabled)
+        first = extractor.get_local_segmentation(roi, 0.2).to_ndarray()
+        second = extractor.get_local_segmentation(roi, 0.2).to_ndarray()
+        assert (first == second).all()
+        assert len(extractor.cache) == min(max_cached_rois, 1)
+
+        # fragments 1 and 2 are merged
+        assert first[0, 0, 0] == first[0, 9, 9]
+        assert len(np.unique(first)) == 3
+
+        # a cached ROI can be segmented for another threshold
+        segmentation = extractor.get_local_segmentation(roi, 0.6)
+        assert len(np.unique(segmentation.to_ndarray())) == 2
+
+        # the cached fragments are not modified by requests
+        assert (
+            extractor.get_local_segmentation(roi, 0.2).to_ndarray() ==
+            first).all()
@@ -0,0 +1,60 @@
+from lsd import MergeHierarchy
+from lsd.persistence import SqliteRagProvider
+import daisy
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('lsd.merge_hierarchy').setLevel(logging.DEBUG)
+
+if __name__ == "__main__":
+
+    np.random.seed(42)
+
+    rag_provider = SqliteRagProvider('test_merge_hierarchy.db', 'w')
+
+    total_roi = daisy.Roi((0, 0, 0), (20, 20, 20))
+
+    # a random graph of 100 fragments
+    sub_rag = rag_provider[total_roi]
+    centers = np.random.uniform(0, 20, size=(100, 3))
+    for node, center in enumerate(centers):
+        sub_rag.add_node(
+            node + 1,
+            center_z=center[0],
+            center_y=center[1],
+            center_x=center[2])
+    for u, v in np.random.randint(1, 101, size=(200, 2)):
+        if u != v:
+            sub_rag.add_edge(
+                int(u), int(v),
+                merge_score=np.random.uniform(),
+                agglomerated=0)
+
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    hierarchy = MergeHierarchy.create(rag_provider, 'test_merge_hierarchy')
+
+    fragments = np.arange(1, 101, dtype=np.uint64).reshape((10, 10))
+
+    for threshold in [0.0, 0.1, 0.5, 1.0]:
+
+        segments = hierarchy.get_segment_ids(fragments, threshold)
+        assert segments.shape == fragments.shape
+
+        # compare against connected components of the networkx RAG
+        components = rag_provider[total_roi].get_connected_components(
+            threshold)
+        assert len(np.unique(segments)) == len(components)
+        for component in components:
+            component_segments = segments[np.isin(fragments, component)]
+            assert len(np.unique(component_segments)) == 1
+
+        print(
+            "%d segments for threshold %g" % (
+                len(components),
+                threshold))
+
+    # unknown fragments are not part of any segment
+    assert hierarchy.get_segment_ids([0, 1000], 1.0).tolist() == [0, 0]
@@ -0,0 +1,49 @@
+from lsd.persistence import MongoDbRagProvider
+import daisy
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger(
+    'lsd.persistence.mongodb_rag_provider').setLevel(logging.DEBUG)
+
+if __name__ == "__main__":
+
+    # requires a MongoDB server on localhost
+
+    total_roi = daisy.Roi((0, 0, 0), (20, 20, 20))
+
+    rag_provider = MongoDbRagProvider(
+        'test_mongodb_rag_provider',
+        host='localhost',
+        mode='w',
+        write_mode='upsert')
+
+    sub_rag = rag_provider[total_roi]
+    sub_rag.add_node(1, center_z=5, center_y=5, center_x=5)
+    sub_rag.add_node(2, center_z=15, center_y=15, center_x=15, size=10)
+    sub_rag.add_edge(1, 2, merge_score=None, agglomerated=0)
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    # syncing a sub-RAG again keeps the centers of neighbors outside of its
+    # ROI
+    sub_rag = rag_provider[daisy.Roi((0, 0, 0), (10, 10, 10))]
+    assert sub_rag.node[2] == {}
+    sub_rag.sync_nodes()
+
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.node[2]['center_z'] == 15
+    assert sub_rag.node[2]['size'] == 10
+
+    # upserts keep attributes that are not written again
+    rag_provider.insert_nodes([(2, {'size': 20})])
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.node[2]['center_z'] == 15
+    assert sub_rag.node[2]['size'] == 20
+
+    sub_rag.edges[1, 2]['merge_score'] = 0.5
+    sub_rag.sync_edges(total_roi)
+    rag_provider.insert_edges([(1, 2, {'agglomerated': 1})])
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.edges[1, 2]['merge_score'] == 0.5
+    assert sub_rag.edges[1, 2]['agglomerated'] == 1
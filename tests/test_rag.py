@@ -0,0 +1,88 @@
+from lsd import Rag
+import copy
+import logging
+import numpy as np
+import skimage.future
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger('lsd.rag_extraction').setLevel(logging.DEBUG)
+
+if __name__ == "__main__":
+
+    np.random.seed(42)
+    fragments = np.random.randint(1, 20, size=(10, 20, 20)).astype(np.uint64)
+
+    for connectivity in [1, 2, 3]:
+
+        rag = Rag(fragments, connectivity=connectivity)
+        skimage_rag = skimage.future.graph.RAG(
+            fragments,
+            connectivity=connectivity)
+
+        edges = set(tuple(sorted(e)) for e in rag.edges())
+        skimage_edges = set(tuple(sorted(e)) for e in skimage_rag.edges())
+
+        assert edges == skimage_edges
+        assert set(rag.nodes()) == set(skimage_rag.nodes())
+
+        for u, v, data in rag.edges(data=True):
+            assert data['contact_area'] > 0
+            assert data['merge_score'] is None
+
+        print(
+            "connectivity %d: %d nodes, %d edges" % (
+                connectivity,
+                rag.number_of_nodes(),
+                rag.number_of_edges()))
+
+    # contracting merged nodes gives the same RAG as merging them one by one
+    rag = Rag(fragments)
+    for u, v, data in rag.edges(data=True):
+        data['merge_score'] = np.random.random()
+        data['agglomerated'] = 1
+
+    reference = copy.deepcopy(rag)
+    for component in reference.get_connected_components(0.05):
+        for i in range(1, len(component)):
+            reference.merge_nodes(
+                component[i - 1],
+                component[i],
+                weight_func=lambda _, _src, _dst, _n: {
+                    'merge_score': None,
+                    'agglomerated': 0
+                })
+
+    rag.contract_merged_nodes(0.05)
+
+    assert set(rag.nodes()) == set(reference.nodes())
+    for node, data in rag.nodes(data=True):
+        assert data['labels'] == reference.node[node]['labels']
+
+    edges = {
+        tuple(sorted((u, v))): data
+        for u, v, data in rag.edges(data=True)
+    }
+    reference_edges = {
+        tuple(sorted((u, v))): data
+        for u, v, data in reference.edges(data=True)
+    }
+    assert edges == reference_edges
+
+    print(
+        "contracted: %d nodes, %d edges" % (
+            rag.number_of_nodes(),
+            rag.number_of_edges()))
+
+    # integer attributes missing on some nodes stay integers
+    rag = Rag()
+    rag.add_node(1, size=10, center_z=0.5)
+    rag.add_node(2, center_z=1.5)
+    rag.add_edge(1, 2, merge_score=None, agglomerated=1)
+
+    copied = Rag.from_arrays(rag.to_arrays())
+    assert copied.node[1]['size'] == 10
+    assert isinstance(copied.node[1]['size'], int)
+    assert 'size' not in copied.node[2]
+    assert copied.node[2]['center_z'] == 1.5
+    assert copied.edges[1, 2]['merge_score'] is None
+    assert copied.edges[1, 2]['agglomerated'] == 1
@@ -0,0 +1,107 @@
+from lsd.persistence import ShardedSqliteRagProvider, SqliteRagProvider
+import daisy
+import logging
+import numpy as np
+import os
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger(
+    'lsd.persistence.sharded_sqlite_rag_provider').setLevel(logging.DEBUG)
+
+if __name__ == "__main__":
+
+    rag_provider = ShardedSqliteRagProvider(
+        'test_sharded_sqlite_rag_provider',
+        'w',
+        shard_size=(10, 10, 10))
+
+    total_roi = daisy.Roi((0, 0, 0), (20, 20, 20))
+
+    # a chain of nodes through four shards, with one node at the boundary
+    # between two shards
+    centers = {
+        1: (5, 5, 5),
+        2: (15, 5, 5),
+        3: (15, 15, 5),
+        4: (10, 15, 5),
+        5: (5, 15, 15)
+    }
+
+    sub_rag = rag_provider[total_roi]
+    for node, center in centers.items():
+        sub_rag.add_node(
+            node,
+            center_z=center[0],
+            center_y=center[1],
+            center_x=center[2])
+    for node in range(1, 5):
+        sub_rag.add_edge(node, node + 1, merge_score=None, agglomerated=0)
+
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    # nodes and edges are stored in the shard containing the center of the
+    # node (the smaller one, for edges)
+    filenames = sorted(
+        f for f in os.listdir('test_sharded_sqlite_rag_provider')
+        if f.startswith('shard_'))
+    assert filenames == [
+        'shard_0_0_0.db',
+        'shard_0_1_1.db',
+        'shard_1_0_0.db',
+        'shard_1_1_0.db'
+    ], filenames
+
+    shard = SqliteRagProvider(
+        os.path.join('test_sharded_sqlite_rag_provider', 'shard_1_1_0.db'),
+        'r')
+    shard_nodes = shard.read_nodes_array()['id']
+    shard_edges = shard.read_edges_array()
+    assert sorted(shard_nodes) == [3, 4]
+    assert sorted(zip(shard_edges['u'], shard_edges['v'])) == [(3, 4), (4, 5)]
+
+    # the whole RAG is read back from all shards
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.number_of_nodes() == 5
+    assert sub_rag.number_of_edges() == 4
+
+    # edges stored in the shard of a node outside of the ROI are found: the
+    # edge (1, 2) is stored with 1 in shard (0, 0, 0)
+    roi = daisy.Roi((10, 0, 0), (10, 10, 10))
+    sub_rag = rag_provider[roi]
+    assert sub_rag.has_edge(1, 2)
+    assert sub_rag.has_edge(2, 3)
+    assert 'center_z' not in sub_rag.node[1]
+    assert rag_provider.num_nodes(roi) == 1
+    assert rag_provider.has_edges(roi)
+
+    # node 5 has no edges in its own shard, the edge (4, 5) is stored with 4
+    # in shard (1, 1, 0)
+    node_roi = daisy.Roi((0, 10, 10), (10, 10, 10))
+    assert rag_provider.has_edges(node_roi)
+    assert rag_provider[node_roi].has_edge(4, 5)
+
+    # no shard in this ROI
+    assert not rag_provider.has_edges(daisy.Roi((0, 0, 10), (10, 10, 10)))
+
+    # bulk reads of all shards
+    nodes = rag_provider.read_nodes_array()
+    edges = rag_provider.read_edges_array(attrs=['merge_score'])
+    assert sorted(nodes['id']) == [1, 2, 3, 4, 5]
+    assert len(edges['u']) == 4
+    assert np.isnan(edges['merge_score']).all()
+
+    # a node without edges, in a shard created after the first reads
+    rag = rag_provider[total_roi]
+    rag.add_node(6, center_z=5, center_y=5, center_x=15)
+    rag.sync_nodes()
+
+    node_roi = daisy.Roi((0, 0, 10), (10, 10, 10))
+    assert rag_provider.num_nodes(node_roi) == 1
+    assert not rag_provider.has_edges(node_roi)
+
+    print(
+        "%d nodes and %d edges in %s" % (
+            sub_rag.number_of_nodes(),
+            sub_rag.number_of_edges(),
+            roi))
@@ -1,4 +1,5 @@
 from lsd.persistence import SqliteRagProvider
+import daisy
 import logging
 import numpy as np
 
@@ -23,3 +24,21 @@ if __name__ == "__main__":
 
     sub_rag = rag_provider[:,:,:]
     print(sub_rag.edges(data=True)[0])
+
+    # syncing a sub-RAG keeps the centers of neighbors outside of its ROI
+    rag_provider = SqliteRagProvider('test_sqlite_rag_provider.db', 'w')
+    total_roi = daisy.Roi((0, 0, 0), (20, 20, 20))
+
+    sub_rag = rag_provider[total_roi]
+    sub_rag.add_node(1, center_z=5, center_y=5, center_x=5)
+    sub_rag.add_node(2, center_z=15, center_y=15, center_x=15)
+    sub_rag.add_edge(1, 2, merge_score=None, agglomerated=0)
+    sub_rag.sync_nodes()
+    sub_rag.sync_edges(total_roi)
+
+    sub_rag = rag_provider[daisy.Roi((0, 0, 0), (10, 10, 10))]
+    assert sub_rag.node[2] == {}
+    sub_rag.sync_nodes()
+
+    sub_rag = rag_provider[total_roi]
+    assert sub_rag.node[2]['center_z'] == 15